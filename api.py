@@ -0,0 +1,125 @@
+""" in-process API: cpmyvideos.py jobs from a long running process
+
+    with api.BatchExecutor(jobs=2) as executor:
+        future = executor.submit(api.JobSpec('in.mp4', ['-d', 'out', '--fmt', 'dnxhr']))
+        print(future.result().state)
+        async for result in executor.results(specs):
+            ...
+
+A batch.Batch is made for each set of options at first use and kept, the
+jobs with the same options share its probe catalog, encoder pool, dedup
+index and caches. Failed jobs give results, they do not exit.
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+import argsp
+import batch
+
+# modes of the cli, not jobs
+CLI_OPTS = ('enqueue', 'worker', 'plan', 'run_plan', 'resume', 'watch')
+
+@dataclass
+class JobSpec:
+    """ src: source file, argv: cpmyvideos.py options without -s """
+    src: str
+    argv: list = field(default_factory=list)
+
+@dataclass
+class JobResult:
+    """ state: last journal state (done, skipped, failed), dst: output,
+    seconds: of the copy or transcode, output: last lines printed by the job,
+    see joblog.JobLog """
+    src: str
+    state: Optional[str] = None
+    dst: Optional[str] = None
+    seconds: float = 0.0
+    rcode: int = 0
+    output: str = ''
+
+def options(argv):
+    """ argv: cpmyvideos.py arguments
+    return: args, encoder module, ValueError if they are bad """
+    try:
+        args, _, enc_mod = argsp.parse_args(argv)
+    except SystemExit as ex:
+        # argparse printed its message
+        raise ValueError(f'bad options {argv}: {ex.code}') from None
+    for name in CLI_OPTS:
+        if getattr(args, name):
+            raise ValueError(f"--{name.replace('_', '-')} is a cpmyvideos.py mode, not a job")
+    return args, enc_mod
+
+def build_command(spec):
+    """ return: command of a job as it would run now, see batch.Batch.build_command() """
+    args, enc_mod = options(spec.argv + ['-s', spec.src])
+    # nothing runs, nothing goes to the journal
+    args.journal = None
+    job_batch = batch.Batch(args, enc_mod)
+    try:
+        job = _job(job_batch, spec)
+        return job_batch.build_command(job) if job else None
+    finally:
+        job_batch.close()
+
+def _job(job_batch, spec):
+    """ return: queued batch.Job, None if the stat-only filters skip it """
+    return job_batch.new_job(spec.src, os.stat(spec.src), buffered=True, progress=False)
+
+class BatchExecutor:
+    """ runs JobSpecs in a thread pool, jobs: at once """
+
+    def __init__(self, jobs=1):
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.lock = threading.Lock()
+        self.batches = {}
+
+    def batch(self, spec):
+        """ return: batch.Batch of the options of spec, made at first use """
+        key = tuple(spec.argv)
+        with self.lock:
+            if key not in self.batches:
+                self.batches[key] = batch.Batch(*options(spec.argv + ['-s', spec.src]))
+            return self.batches[key]
+
+    def run(self, spec):
+        """ process a job in this thread, return: JobResult """
+        job_batch = self.batch(spec)
+        job = _job(job_batch, spec)
+        if job is None:
+            return JobResult(spec.src, state='skipped')
+        result = JobResult(spec.src)
+        try:
+            result.seconds = job_batch.process_file(job)
+        except batch.JobFailed as ex:
+            result.rcode = ex.rcode
+        result.state, result.dst, result.output = job.state, job.dst, job.out.getvalue()
+        return result
+
+    def submit(self, spec):
+        """ return: concurrent.futures.Future of the JobResult """
+        return self.executor.submit(self.run, spec)
+
+    async def results(self, specs):
+        """ yield: JobResults as the jobs finish """
+        futures = [asyncio.wrap_future(self.submit(spec)) for spec in specs]
+        for future in asyncio.as_completed(futures):
+            yield await future
+
+    def close(self):
+        """ wait for the jobs, close the batches, write their manifests """
+        self.executor.shutdown()
+        for job_batch in self.batches.values():
+            job_batch.close()
+            if job_batch.args.checksum and not job_batch.args.dry:
+                job_batch.write_manifests()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -3,22 +3,102 @@
 
 import argparse
 import os
+import re
 import sys
+import time
 import importlib
-import dateparser
+from datetime import datetime
 import lib
+import catalog
+import workqueue
+import journal
+import autocrf
+import plan
+import pool
+import piped
+import multi
+import governor
+import watch
+import quality
 #import enc_dnxhr
 #import enc_prores
 #import enc_cineform
 
-def parse_args():
-    """ return: args, crf, encoder module """
+# options of the enqueueing run, not passed on to queued jobs: takes a value,
+# '+': takes the values up to the next option
+QUEUE_OPTS = {'-s': True, '-d': '+', '--queue': True, '--lease': True, '-j': True,
+              '--jobs': True, '--enqueue': False, '--worker': False, '-1': False,
+              '--watch': False, '--settle': True, '--poll': True}
+
+# options of the planning run, not recorded in the plan
+PLAN_OPTS = {'--plan': True, '--run-plan': True, '--dry': False}
+
+def job_argv(argv, dst_dirs):
+    """ cli arguments for a queued job, without queue options and -s """
+    out = strip_opts(argv, QUEUE_OPTS)
+    # workers may run elsewhere
+    for dst_dir in dst_dirs:
+        out += ['-d', os.path.abspath(dst_dir)]
+    return out
+
+# --newer relative to now: 3d, 12h, 90m
+RELATIVE_RE = re.compile(r'(\d+(?:\.\d+)?)\s*([smhdw])(?:\s+ago)?', re.I)
+SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+# recorded with a journal batch
+BATCH_PARAMS = ('fmt', 'enc', 'crf', 'bits', 'res', 'preset', 'tune', 'gop', 'all_i',
+                'params', 'profile', 'copy', 'duration', 'nometa', 'chunks', 'target_quality',
+                'pool', 'pipe', 'enc_args', 'proxy', 'thumbs', 'remux', 'max_bitrate')
+
+def strip_opts(argv, opts):
+    """ argv without opts and their values, opts: name -> False: a flag,
+    True: takes a value, '+': takes the values up to the next option """
+    out = []
+    skip = None
+    for arg in argv:
+        if skip == '+' and not arg.startswith('-'):
+            continue
+        if skip is True:
+            skip = None
+            continue
+        skip = None
+        name = arg.split('=', 1)[0]
+        if name in opts:
+            skip = None if '=' in arg else opts[name] or None
+        elif name.startswith('--') or name[:2] not in opts:
+            out.append(arg)
+        # else a short option with its value attached: -sFILE, -j4
+    return out
+
+def override(recorded, given):
+    """ recorded arguments of a batch followed by the given ones, a given -d
+    replaces the recorded destinations instead of adding to them """
+    if strip_opts(given, {'-d': '+'}) != given:
+        recorded = strip_opts(recorded, {'-d': '+'})
+    return recorded + given
+
+def batch_params(args):
+    return {name: getattr(args, name) for name in BATCH_PARAMS}
+
+def parse_args(argv=None):
+    """ argv: cpmyvideos.py arguments, default sys.argv[1:]
+    return: args, crf, encoder module """
 
     parser = argparse.ArgumentParser(description='Video copy/scale/convert')
     parser.add_argument('-s', dest='src_path', help='Source file or directory')
-    parser.add_argument('-d', dest='dst_dir', help='Destination directory')
-    parser.add_argument('-n', '--newer', help='Newer than')
+    parser.add_argument('-d', dest='dst_dirs', action='extend', nargs='+',
+                        help='Destination directory, several with --copy')
+    parser.add_argument('-n', '--newer',
+                        help="Newer than: '3d', '12h' ago, ISO date/time, epoch seconds, "
+                             "free form like 'yesterday'")
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='Recurse into source subdirectories (flat destination)')
+    parser.add_argument('--min-size', type=float, default=0,
+                        help='Skip files smaller than this, MiB')
     parser.add_argument('--copy', action='store_true', help='Copy as is')
+    parser.add_argument('--checksum', action='store_true',
+                        help='Hash copies while read, verify and write a manifest, '
+                             'default with several destinations')
     parser.add_argument('--res', type=int, choices=lib.RESOLUTIONS,
                         help='Resolution')
     parser.add_argument('--fmt', default='hevc', choices=lib.FORMATS,
@@ -26,46 +106,319 @@ def parse_args():
     parser.add_argument('--preset', help='Preset HEVC/NVENC')
     parser.add_argument('--tune', help='Tune HEVC/NVENC')
     parser.add_argument('--crf', type=int, help=f'crf/quality ({lib.CRF})')
+    parser.add_argument('--target-quality', metavar='METRIC:VALUE',
+                        help="Search the crf per file for a quality, e.g. 'ssim:0.98', 'vmaf:95'")
     parser.add_argument('--gop', type=float,
                         help='gop, float multiplier of fps')
     parser.add_argument('--params', help='Params HEVC')
     parser.add_argument('--profile', help='DNxHR/ProRes/CineForm profile')
     parser.add_argument('--enc', default='x265', choices=lib.ENCODERS,
                         help='Encoder (%(default)s)')
+    parser.add_argument('--pool', action='append', metavar='ENC:N[:WHERE]',
+                        help='HEVC encoders used at the same time instead of --enc, N sessions '
+                             "each, optional media info condition, e.g. --pool x265:1 "
+                             "--pool 'nvenc:3:height<=2160', first free one by order")
     parser.add_argument('--bits', choices=[8, 10], type=int,
                         help='Bit depth')
     parser.add_argument('--all-i', action='store_true', dest='all_i',
                         help='All Intra')
     parser.add_argument('--nometa', action='store_true',
                         help='Do not map metadata')
+    parser.add_argument('--remux', action='store_true',
+                        help='Stream copy HEVC sources that already meet the target '
+                             '(format, bit depth, chroma, profile, resolution, gop)')
+    parser.add_argument('--max-bitrate', type=float,
+                        help='With --remux only sources up to this bit rate, Mbps')
     parser.add_argument('--fnparams', action='store_true',
                         help='Add params to dest file names')
     parser.add_argument('-t', type=int, dest='duration')
     parser.add_argument('-1', dest='first', action='store_true',
                         help='only 1st found file')
+    parser.add_argument('--catalog', nargs='?', const='',
+                        help='Probe catalog file (default in user cache dir)')
+    parser.add_argument('--dedup', nargs='?', const='',
+                        help='Skip sources with the same content as ones processed before '
+                             'with the same parameters, index file (default in user cache dir)')
+    parser.add_argument('--dedup-link', action='store_true',
+                        help='Hard link (else symlink) the earlier outputs to the destinations')
+    parser.add_argument('--where',
+                        help='Select by media info, e.g. '
+                             "'bit_depth=10 and height>=2160 and format!=HEVC'")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='Append per file metrics as JSON lines')
+    parser.add_argument('--timeout', type=float,
+                        help='Terminate an encode after this many seconds')
+    parser.add_argument('--chunks', type=int, default=1,
+                        help='Split long files at keyframes, encode N segments in parallel')
+    parser.add_argument('--pipe', choices=piped.ENCODERS,
+                        help='Decode and scale with ffmpeg, encode from a pipe with the x265 '
+                             'CLI or another ffmpeg, mux audio afterwards')
+    parser.add_argument('--dec-threads', type=int, help='Decoder threads with --pipe')
+    parser.add_argument('--enc-threads', type=int, help='Encoder threads with --pipe')
+    parser.add_argument('--enc-args',
+                        help="More encoder CLI options with --pipe, e.g. --enc-args='--no-sao'")
+    parser.add_argument('--proxy', action='append', metavar='FMT:HEIGHT[:PROFILE]',
+                        help='Also make an editing proxy in the same decode, e.g. hevc:540, '
+                             f'prores:720:proxy, formats {multi.PROXY_FORMATS}')
+    parser.add_argument('--thumbs', type=int, default=0,
+                        help='Also make this many poster thumbnails in the same decode')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Parallel jobs in directory mode (1, --pool: all sessions)')
+    parser.add_argument('--max-jobs', type=int,
+                        help='Adapt the parallel jobs between -j and this to the CPU, memory '
+                             'and IO pressure, load and available memory of the host')
+    parser.add_argument('--nice', type=int, default=0,
+                        help='Run the encoders this much nicer, 1-19')
+    parser.add_argument('--ionice', choices=list(governor.IOPRIO_CLASSES),
+                        help='Run the encoders in this IO scheduling class')
+    parser.add_argument('--queue', metavar='DIR',
+                        help='Work queue directory on a shared filesystem')
+    parser.add_argument('--enqueue', action='store_true',
+                        help='Add found files to the queue, other options apply to the jobs')
+    parser.add_argument('--worker', action='store_true',
+                        help='Run queued jobs until the queue is empty, -j of them at once')
+    parser.add_argument('--lease', type=float, default=workqueue.LEASE_TIME,
+                        help='Reclaim jobs of workers silent this long, s (%(default)s)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running, process new files of the source directory '
+                             'as they arrive, with --enqueue queue them')
+    parser.add_argument('--settle', type=float, default=watch.SETTLE,
+                        help='--watch: seconds the size and mtime of a new file must '
+                             'stay unchanged (%(default)s)')
+    parser.add_argument('--poll', type=float, default=0,
+                        help='--watch: scan every this many seconds instead of inotify, '
+                             'for network filesystems')
+    parser.add_argument('--logs', metavar='DIR',
+                        help='Write the full output of each job to DIR/NAME.log')
+    parser.add_argument('--journal', metavar='FILE',
+                        help='Record the state of each file of the batch')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue the last --journal batch: its source again without '
+                             'the files it finished, with its options, given options override them')
+    parser.add_argument('--plan', metavar='FILE',
+                        help='Probe all files first, run the longest first, write the plan '
+                             "as JSON to FILE ('-': stdout), only that with --dry")
+    parser.add_argument('--run-plan', metavar='FILE',
+                        help='Run the files of a --plan in its order with its options, '
+                             'given options override them')
     parser.add_argument('--dry', action='store_true',
                         help='Dry run')
-    args = parser.parse_args()
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parser.parse_args(argv)
+
+    if args.resume:
+        if not args.journal:
+            sys.exit('Need --journal to resume')
+        try:
+            batch = journal.load(args.journal)
+        except OSError as ex:
+            sys.exit(f'Cannot read journal: {ex}')
+        if batch is None:
+            sys.exit(f"No batch in journal '{args.journal}'")
+        path = os.path.abspath(args.journal)
+        # relative paths of the batch
+        os.chdir(batch.cwd)
+        args = parser.parse_args(override(batch.argv, argv))
+        args.journal = path
+        args.unfinished = batch.unfinished()
+        args.finished = batch.finished()
+    args.batch_argv = argv
+    if args.run_plan:
+        args = load_plan(parser, args, argv)
+
+    if args.plan and (args.enqueue or args.worker):
+        sys.exit('--plan runs the files here, not with --enqueue/--worker')
+    if (args.enqueue or args.worker) and not args.queue:
+        sys.exit('Need --queue directory')
+    if args.enqueue and args.worker:
+        sys.exit('Either --enqueue or --worker')
+    if not args.worker:
+        if args.src_path is None:
+            sys.exit('Need source directory or file')
+        if not args.dst_dirs:
+            sys.exit('Need target directory')
+        if not os.path.exists(args.src_path):
+            sys.exit(f"Source dir or file '{args.src_path}' doesn't exist")
+        for dst_dir in args.dst_dirs:
+            if not os.path.exists(dst_dir):
+                sys.exit(f"Destination dir '{dst_dir}' doesn't exist")
+    if args.logs and not os.path.isdir(args.logs):
+        sys.exit(f"Log dir '{args.logs}' doesn't exist")
+    if (len(args.dst_dirs or ()) > 1 or args.checksum) and not args.copy:
+        sys.exit('Several destinations and --checksum need --copy')
+    args.checksum = args.checksum or len(args.dst_dirs or ()) > 1
+    args.dst_dir = args.dst_dirs[0] if args.dst_dirs else None
+    if args.pool:
+        parse_pool(args)
+    if args.jobs is None:
+        args.jobs = pool.Pool(args.pool_specs).size if args.pool else 1
+    if args.jobs < 1:
+        sys.exit('Need at least 1 job')
+    if args.max_jobs:
+        check_max_jobs(args)
+    if not 0 <= args.nice <= 19:
+        sys.exit('Need --nice 1-19')
+    if args.lease <= 0:
+        sys.exit('Need a positive --lease')
+    if args.enqueue:
+        args.job_argv = job_argv(argv, args.dst_dirs)
 
-    if args.src_path is None:
-        sys.exit('Need source directory or file')
-    if args.dst_dir is None:
-        sys.exit('Need target directory')
-    if not os.path.exists(args.src_path):
-        sys.exit(f"Source dir or file '{args.src_path}' doesn't exist")
-    if not os.path.exists(args.dst_dir):
-        sys.exit(f"Destination dir '{args.dst_dir}' doesn't exist")
+    if args.watch or args.poll:
+        check_watch(args)
+    if args.pipe or args.dec_threads or args.enc_threads or args.enc_args:
+        check_pipe(args)
+    if args.proxy or args.thumbs:
+        check_multi(args)
+    if args.remux or args.max_bitrate:
+        check_remux(args)
+    if args.target_quality:
+        target_quality(args)
+    if not args.pool:
+        args.crf = args.crf or lib.CRF.get(args.enc) or lib.CRF.get(args.fmt)
+    crf = args.crf
 
-    crf = args.crf if args.crf else lib.CRF.get(args.enc) or lib.CRF.get(args.fmt)
+    if args.catalog == '':
+        args.catalog = lib.cache_path('catalog.sqlite')
+    if args.dedup == '':
+        args.dedup = lib.cache_path('dedup.sqlite')
+    if args.dedup_link and args.dedup is None:
+        sys.exit('--dedup-link needs --dedup')
+    if args.where:
+        try:
+            args.where = catalog.parse_where(args.where)
+        except ValueError as ex:
+            sys.exit(f'Bad --where: {ex}')
 
     if args.newer:
-        args.newer = dateparser.parse(args.newer).timestamp()
+        try:
+            args.newer = parse_time(args.newer)
+        except ValueError as ex:
+            sys.exit(f'Bad --newer: {ex}')
+
+    # --pool: the encoder of each file is chosen when it runs
+    return args, crf, encoder_module(args.fmt, args.enc) if args.enc else None
+
+def parse_time(text):
+    """ '3d'/'12h' ago, ISO date/time (local without zone), epoch seconds,
+    else free form with dateparser, slow to import
+    return: timestamp """
+    text = text.strip()
+    if match := RELATIVE_RE.fullmatch(text):
+        return time.time() - float(match[1]) * SECONDS[match[2].lower()]
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    parsed = importlib.import_module('dateparser').parse(text)
+    if parsed is None:
+        raise ValueError(f"cannot parse '{text}'")
+    return parsed.timestamp()
+
+def load_plan(parser, args, argv):
+    """ return: args with the options of the plan, args.planned: its files """
+    if args.resume:
+        sys.exit('Either --resume or --run-plan')
+    try:
+        batch = plan.load(args.run_plan)
+    except (OSError, ValueError) as ex:
+        sys.exit(f'Cannot read plan: {ex}')
+    # relative paths of the plan
+    os.chdir(batch['cwd'])
+    argv = override(batch['argv'], argv)
+    args = parser.parse_args(argv)
+    args.batch_argv = strip_opts(argv, {'--run-plan': True})
+    args.planned = [entry['src'] for entry in batch['files']]
+    return args
+
+def parse_pool(args):
+    """ args.pool_specs: pool.Pool specs, args.enc: None """
+    if args.copy or args.fmt != 'hevc':
+        sys.exit('--pool needs --fmt hevc')
+    try:
+        args.pool_specs = [pool.parse(spec) for spec in args.pool]
+    except ValueError as ex:
+        sys.exit(f'Bad --pool: {ex}')
+    for enc, _, _ in args.pool_specs:
+        if enc not in lib.ENCODERS:
+            sys.exit(f"Bad --pool: encoder '{enc}' not one of {lib.ENCODERS}")
+    if len({spec[0] for spec in args.pool_specs}) != len(args.pool_specs):
+        sys.exit('Bad --pool: encoder given twice')
+    args.enc = None
+
+def check_pipe(args):
+    if not args.pipe:
+        sys.exit('--dec-threads, --enc-threads and --enc-args need --pipe')
+    if args.copy or args.pool or args.chunks > 1:
+        sys.exit('--pipe does not go with --copy, --pool or --chunks')
+    if args.fmt == 'hevc' and args.enc != 'x265':
+        sys.exit('--pipe encodes HEVC with x265 only')
+    if args.pipe == 'x265' and args.fmt != 'hevc':
+        sys.exit(f'--pipe x265 cannot encode {args.fmt}, use --pipe ffmpeg')
+    if args.pipe == 'x265' and not piped.x265_muxable(args.enc_args):
+        sys.exit("--pipe x265 needs ffmpeg 7.1 to mux B-frames, or --enc-args='--bframes 0'")
+
+def check_multi(args):
+    """ args.proxy: multi.parse_proxy() specs """
+    if args.copy or args.pipe or args.pool or args.chunks > 1:
+        sys.exit('--proxy and --thumbs do not go with --copy, --pipe, --pool or --chunks')
+    if args.thumbs < 0:
+        sys.exit('Need a positive --thumbs')
+    encoder = encoder_module(args.fmt, args.enc).Encoder
+    # one ffmpeg decoding to system memory feeds all the outputs
+    if hasattr(encoder, 'CMD') or hasattr(encoder, 'get_params_in'):
+        sys.exit(f'--proxy and --thumbs need a software decoded ffmpeg encoder, not {args.enc}')
+    try:
+        args.proxy = [multi.parse_proxy(spec) for spec in args.proxy or ()]
+    except ValueError as ex:
+        sys.exit(f'Bad --proxy: {ex}')
+
+def check_max_jobs(args):
+    if args.max_jobs < args.jobs:
+        sys.exit('Need --max-jobs of at least -j')
+    if args.worker or args.enqueue or args.dry:
+        sys.exit('--max-jobs runs the files here, not with --worker, --enqueue or --dry')
+
+def check_watch(args):
+    if not args.watch:
+        sys.exit('--poll needs --watch')
+    if args.worker or args.plan or args.run_plan or args.resume or args.first:
+        sys.exit('--watch does not go with --worker, --plan, --run-plan, --resume or -1')
+    if not os.path.isdir(args.src_path):
+        sys.exit('--watch needs a source directory')
+    if args.settle < 0 or args.poll < 0:
+        sys.exit('Need positive --settle and --poll')
+
+def check_remux(args):
+    if not args.remux:
+        sys.exit('--max-bitrate needs --remux')
+    if args.copy or args.fmt != 'hevc':
+        sys.exit('--remux needs --fmt hevc')
+    if args.proxy or args.thumbs:
+        sys.exit('--remux does not go with --proxy or --thumbs')
 
-    if args.fmt in ('dnxhr', 'prores', 'cineform'):
-        enc_mod = importlib.import_module(f'enc_{args.fmt}')
-    elif args.fmt == 'hevc':
-        enc_mod = importlib.import_module(f'enc_{args.fmt}_{args.enc}')
-    else:
-        sys.exit(f"Unsupported encoder format/type: {args.fmt}{args.enc}")
+def target_quality(args):
+    if args.copy or args.fmt != 'hevc':
+        sys.exit('--target-quality needs --fmt hevc')
+    if args.crf:
+        sys.exit('Either --crf or --target-quality')
+    for enc in [spec[0] for spec in args.pool_specs] if args.pool else [args.enc]:
+        if hasattr(encoder_module(args.fmt, enc), 'CMD'):
+            sys.exit(f'--target-quality needs ffmpeg encoders, not {enc}')
+    try:
+        args.target_quality = autocrf.parse_target(args.target_quality)
+    except ValueError as ex:
+        sys.exit(f'Bad --target-quality: {ex}')
+    if args.target_quality[0] == 'vmaf' and not quality.has_vmaf():
+        sys.exit('ffmpeg has no libvmaf')
 
-    return args, crf, enc_mod
+def encoder_module(fmt, enc):
+    if fmt in ('dnxhr', 'prores', 'cineform'):
+        return importlib.import_module(f'enc_{fmt}')
+    if fmt == 'hevc':
+        return importlib.import_module(f'enc_{fmt}_{enc}')
+    return sys.exit(f"Unsupported encoder format/type: {fmt}{enc}")
@@ -0,0 +1,133 @@
+""" per file CRF for a target quality: short samples of the source are
+encoded at candidate CRFs, bisection finds the highest CRF whose worst
+sample still meets the target; results are cached by source fingerprint """
+
+import copy
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import dedup
+import encode
+import quality
+import runner
+
+SAMPLES = 3
+SAMPLE_SECONDS = 4.0
+CRF_RANGE = (12, 36)
+METRICS = ('vmaf', 'ssim')
+
+def parse_target(text):
+    """ 'ssim:0.98', 'vmaf:95' -> ('ssim', 0.98) """
+    metric, _, value = text.partition(':')
+    metric = metric.lower()
+    if metric not in METRICS:
+        raise ValueError(f"metric '{metric}' not one of {METRICS}")
+    try:
+        return metric, float(value)
+    except ValueError:
+        raise ValueError(f"bad value '{value}'") from None
+
+class Cache:
+    """ sqlite: fingerprint, parameters and target -> crf """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS crf (fingerprint, params, crf, score, time, '
+                        'PRIMARY KEY (fingerprint, params))')
+        self.db.commit()
+
+    def get(self, finger, params):
+        """ return: (crf, score) or None """
+        with self.lock:
+            return self.db.execute('SELECT crf, score FROM crf WHERE fingerprint=? AND params=?',
+                                   (finger, params)).fetchone()
+
+    def put(self, finger, params, crf, score):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO crf VALUES (?, ?, ?, ?, ?)',
+                            (finger, params, crf, score, time.time()))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class Search:
+    """ opts: cli args with target_quality (metric, value)
+    opts, enc_mod, info: see encode.Command """
+
+    def __init__(self, opts, enc_mod, info, out=None):
+        self.opts = opts
+        self.enc_mod = enc_mod
+        self.info = info
+        self.out = out
+        self.scores = {}
+
+    def run(self, src, cache=None, params=None):
+        """ params: dict of the encode parameters for the cache
+        return: crf, worst sample score at that crf """
+        key = json.dumps([self.opts.target_quality, params], sort_keys=True)
+        finger = dedup.fingerprint(src) if cache else None
+        if cache and (cached := cache.get(finger, key)):
+            print(f'AUTOCRF cached crf {cached[0]}', file=self.out)
+            return tuple(cached)
+        metric, target = self.opts.target_quality
+        low, high = CRF_RANGE
+        best = None
+        with tempfile.TemporaryDirectory(prefix='autocrf-') as temp:
+            while low <= high:
+                crf = (low + high) // 2
+                score = self.score(src, crf, temp)
+                print(f'AUTOCRF crf {crf}: {metric} {score}', file=self.out)
+                if score is not None and score >= target:
+                    best = crf
+                    low = crf + 1
+                else:
+                    high = crf - 1
+            if best is None:
+                # target out of reach, best effort
+                best = CRF_RANGE[0]
+                self.score(src, best, temp)
+        if cache and self.scores[best] is not None:
+            cache.put(finger, key, best, self.scores[best])
+        return best, self.scores[best]
+
+    def samples(self):
+        """ return: [(start seconds, frames)] spread over the source """
+        info = self.info
+        fps = float(info.frame_rate or 25)
+        duration = info.duration or SAMPLE_SECONDS
+        if self.opts.duration:
+            duration = min(duration, self.opts.duration)
+        frames = max(int(SAMPLE_SECONDS * fps), 1)
+        if duration <= SAMPLES * SAMPLE_SECONDS:
+            return [(0, int(duration * fps))]
+        return [(duration * (idx + 0.5) / SAMPLES - SAMPLE_SECONDS / 2, frames)
+                for idx in range(SAMPLES)]
+
+    def score(self, src, crf, temp):
+        """ encode the samples at crf, return: worst score, None if failed """
+        if crf in self.scores:
+            return self.scores[crf]
+        opts = copy.copy(self.opts)
+        opts.crf = crf
+        command = encode.Command(opts, self.enc_mod, self.info)
+        samples = self.samples()
+        dsts = [os.path.join(temp, f'crf{crf}_{idx}.MOV') for idx in range(len(samples))]
+        cmds = [command.build(src, dst, segment=sample) for sample, dst in zip(samples, dsts)]
+        codes = runner.run_sync(runner.run_many(cmds, fail_fast=True, out=io.StringIO()))
+        scores = [None]
+        if all(code == 0 for code in codes):
+            metric = self.opts.target_quality[0]
+            fps = float(self.info.frame_rate or 25)
+            scores = [quality.measure(src, dst, (self.info.width, self.info.height),
+                                      metric == 'vmaf', (start, frames / fps))[metric]
+                      for (start, frames), dst in zip(samples, dsts)]
+        self.scores[crf] = None if None in scores else min(scores)
+        return self.scores[crf]
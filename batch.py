@@ -0,0 +1,670 @@
+""" a batch of files processed with one set of options: each is copied,
+transcoded or remuxed, sharing the probe catalog, metrics, journal, dedup
+index, encoder pool and autocrf cache; cpmyvideos.py and api.py drive it """
+
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from timeit import default_timer as timer
+import contextlib
+import importlib
+import os
+import sys
+import shutil
+import threading
+import time
+from typing import Any, Optional
+from mymediainfo import MyMediaInfo
+import argsp
+import lib
+import runner
+from catalog import Catalog
+import discover
+import encode
+import chunked
+import piped
+import multi
+import governor
+import joblog
+import watch
+import workqueue
+import journal
+import fastcopy
+import dedup
+import autocrf
+import plan
+from metrics import Metrics, MetricsWriter
+from pool import Pool
+
+class JobFailed(Exception):
+    """ copy or transcode of a job failed, rcode: its exit code """
+
+    def __init__(self, job, rcode):
+        super().__init__(f'{job.src_file} failed with code: {rcode}')
+        self.rcode = rcode
+
+@dataclass
+class Job:
+    """ per file state, out: text stream for the job output """
+    # pylint: disable=too-many-instance-attributes
+    src_file: str
+    filename: str
+    out: Any = None
+    debug: list = field(default_factory=list)
+    stat: Optional[os.stat_result] = None
+    metrics: Metrics = field(default_factory=Metrics)
+    # probe() result of the planning phase
+    probed: Optional[tuple] = None
+    # --pool: encoder of the job
+    enc: Optional[str] = None
+    # last journal state and output
+    state: Optional[str] = None
+    dst: Optional[str] = None
+
+    def print(self, *values):
+        print(*values, file=self.out)
+
+class Batch:
+    """ args, enc_mod: see argsp.parse_args(), the stores are opened here
+    and closed by close() """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, args, enc_mod):
+        self.args = args
+        self.enc_mod = enc_mod
+        self.catalog = Catalog(args.catalog) if args.catalog else None
+        self.metrics = MetricsWriter(args.metrics) if args.metrics else None
+        self.queue = workqueue.Queue(args.queue, args.lease) if args.queue else None
+        self.dedup = dedup.Index(args.dedup) if args.dedup else None
+        self.pool = Pool(args.pool_specs) if args.pool else None
+        self.autocrf_cache = (autocrf.Cache(lib.cache_path('autocrf.sqlite'))
+                              if args.target_quality else None)
+        # source of each output base name
+        self.base_names = {}
+        # bytes copied by --copy jobs
+        self.copied = []
+        # --watch: job output is printed whole
+        self.output_lock = threading.Lock()
+        self.governor = governor.Governor(args.jobs, args.max_jobs) if args.max_jobs else None
+        # manifest lines by destination directory
+        self.manifests = {os.path.normpath(dst_dir): [] for dst_dir in args.dst_dirs or ()}
+        self.journal = (journal.Journal(args.journal, None if args.resume else args.batch_argv,
+                                        argsp.batch_params(args))
+                        if args.journal and not (args.dry or args.worker or args.enqueue)
+                        else None)
+
+    def close(self):
+        for store in (self.catalog, self.metrics, self.journal, self.dedup, self.autocrf_cache):
+            if store:
+                store.close()
+
+    def _job_opts(self, job):
+        """ return: options and encoder module of the job, with --pool its encoder """
+        if job.enc is None:
+            return self.args, self.enc_mod
+        opts = Namespace(**vars(self.args))
+        opts.enc = job.enc
+        opts.crf = self.args.crf or lib.CRF.get(job.enc) or lib.CRF['hevc']
+        return opts, argsp.encoder_module(self.args.fmt, job.enc)
+
+    def _transcode(self, job, dst, info, extra=None):
+        """ extra: multi.MultiOutput made in the same run """
+        opts, enc_mod = self._job_opts(job)
+        if self.args.remux:
+            command = encode.Command(opts, enc_mod, info)
+            reasons = command.compliance(job.src_file, self.args.max_bitrate)
+            job.metrics.data['remux'] = not reasons
+            if not reasons:
+                job.print('REMUX source meets the target, stream copy')
+                with job.metrics.phase('remux'):
+                    return lib.run_cmd(command.remux(job.src_file, dst), dry=self.args.dry,
+                                       out=job.out, stats=job.metrics.stats,
+                                       timeout=self.args.timeout)
+            job.print(f'ENCODE source does not meet the target: {", ".join(reasons)}')
+        if self.args.target_quality and not self.args.dry:
+            with job.metrics.phase('autocrf'):
+                opts = Namespace(**vars(opts))
+                opts.crf, score = self._search_crf(job, info)
+            job.metrics.data.update(crf=opts.crf, score=score)
+            job.print(f'AUTOCRF crf {opts.crf}, {self.args.target_quality[0]} {score}')
+        with job.metrics.phase('plan'):
+            command = encode.Command(opts, enc_mod, info)
+            if hasattr(command.encoder, 'idx'):
+                job.print(f'> idx: {command.encoder.idx}')
+            cmd = command.build(job.src_file, dst,
+                                progress=bool(self.metrics) and not command.external)
+            if extra:
+                cmd = extra.build(job.src_file, dst, [command] + self._proxies(opts, info),
+                                  progress=bool(self.metrics))
+        if self.args.pipe:
+            with job.metrics.phase('encode'):
+                encoder = piped.PipedEncode(command, job.src_file, dst, out=job.out)
+                return encoder.run(self.args.pipe, (self.args.dec_threads, self.args.enc_threads),
+                                   dry=self.args.dry, stats=job.metrics.stats,
+                                   timeout=self.args.timeout)
+        if self.args.chunks > 1:
+            with job.metrics.phase('encode'):
+                encoder = chunked.ChunkedEncode(command, job.src_file, dst, out=job.out)
+                return encoder.run(self.args.chunks, dry=self.args.dry, stats=job.metrics.stats,
+                                   timeout=self.args.timeout)
+        with job.metrics.phase('encode'):
+            return lib.run_cmd(cmd1=cmd, dry=self.args.dry, out=job.out, stats=job.metrics.stats,
+                               timeout=self.args.timeout)
+
+    def _proxies(self, opts, info):
+        """ return: encode.Command of each --proxy """
+        return [encode.Command(multi.proxy_opts(opts, spec),
+                               argsp.encoder_module(spec[0], 'x265'), info)
+                for spec in self.args.proxy or ()]
+
+    def _search_crf(self, job, info):
+        """ return: highest crf meeting --target-quality, score """
+        opts, enc_mod = self._job_opts(job)
+        params = argsp.batch_params(opts)
+        del params['crf'], params['target_quality'], params['pool']
+        search = autocrf.Search(opts, enc_mod, info, out=job.out)
+        return search.run(job.src_file, self.autocrf_cache, params)
+
+    def _copy(self, job, dsts):
+        """ copy to the dsts via part files renamed when complete
+        return: 0, 1 if a copy does not match the source """
+        for dst in dsts:
+            job.print(f"COPY {job.src_file} {dst}")
+        if self.args.dry:
+            return 0
+        parts = [lib.part_name(dst) for dst in dsts]
+        start = timer()
+        digest = None
+        if self.args.checksum:
+            # one read of the source for all destinations
+            size, digest = fastcopy.fan_out(job.src_file, parts)
+            method, resumed = 'fan_out', 0
+        else:
+            size, method, resumed = fastcopy.copy(job.src_file, parts[0])
+        seconds = timer() - start
+        for part in parts:
+            shutil.copystat(job.src_file, part)
+            os.chmod(part, 0o644)
+        self.copied.append(size)
+        job.metrics.data.update(copy_method=method, bytes_copied=size)
+        resumed = f', resumed at {resumed / 2**20:.1f} MiB' if resumed else ''
+        job.print(f'COPIED {size / 2**20:.1f} MiB, {size / 1e6 / max(seconds, 1e-6):.1f} MB/s '
+                  f'({method}{resumed})')
+        if digest and not self._verify(job, dsts, parts, digest):
+            return 1
+        for part, dst in zip(parts, dsts):
+            lib.publish(part, dst)
+        return 0
+
+    def _verify(self, job, dsts, parts, digest):
+        """ compare the copies with the source hash, add them to the manifests
+        return: False if a copy does not match, it is removed """
+        job.metrics.data['checksum'] = digest
+        with job.metrics.phase('verify'), ThreadPoolExecutor(len(parts)) as pool:
+            hashes = list(pool.map(fastcopy.file_hash, parts))
+        bad = [part for part, part_hash in zip(parts, hashes) if part_hash != digest]
+        for part in bad:
+            job.print(f'CHECKSUM mismatch {part}')
+            os.remove(part)
+        if bad:
+            return False
+        job.print(f'VERIFIED {fastcopy.HASH_NAME} {digest}')
+        for dst in dsts:
+            dst_dir, name = os.path.split(dst)
+            self.manifests[os.path.normpath(dst_dir)].append(f'{digest}  {name}\n')
+        return True
+
+    def write_manifests(self):
+        """ checksums of the copies of this batch, per destination directory """
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        for dst_dir, lines in self.manifests.items():
+            if lines:
+                path = os.path.join(dst_dir, f'MANIFEST-{stamp}.{fastcopy.HASH_NAME}')
+                with open(path, 'w', encoding='utf-8') as file:
+                    file.writelines(sorted(lines, key=lambda line: line.split('  ', 1)[1]))
+                print(f'MANIFEST {path}')
+
+    def _format_name(self, job, name, info):
+        opts, _ = self._job_opts(job)
+        if self.args.fmt == 'dnxhr':
+            if self.args.profile:
+                dnxp = self.args.profile
+            else:
+                idx = f'{info.color_format}:{info.bit_depth}'
+                dnxp = self.enc_mod.PROFILES_AUTO[idx]
+            job.debug.append(f'DNxHR profile: {dnxp}')
+            name += f'_{self.args.fmt}_{dnxp}'
+        elif self.args.fmt in ('prores', 'cineform'):
+            prof = f'_{self.args.profile}' if self.args.profile else ''
+            name +=  f'_{self.args.fmt}{prof}'
+        else:
+            name += f'_{self.args.fmt}_{opts.enc}'
+        if self.args.target_quality:
+            metric, value = self.args.target_quality
+            name += f'_tq-{metric}{value:g}'
+        elif opts.crf:
+            name += f'_crf{opts.crf}'
+        if self.args.bits:
+            name += f'_bit{self.args.bits}'
+        if self.args.res and self.args.res < info.height:
+            name += f'_res{self.args.res}'
+        else:
+            name += f'_res{info.height}'
+        if self.args.preset:
+            name += f'_p-{self.args.preset}'
+        if self.args.tune:
+            name += f'_tun={self.args.tune}'
+        if self.args.gop:
+            name += f'_gop{lib.gop(info.frame_rate, self.args.gop)}'
+        if self.args.all_i:
+            name += '_alli'
+        return name
+
+    def probe(self, job):
+        """ return: mime type, MyMediaInfo (None if not a video) """
+        if job.probed:
+            return job.probed
+        path = os.path.abspath(job.src_file)
+        stat = job.stat or os.stat(path)
+        if self.catalog:
+            with job.metrics.phase('probe'):
+                cached = self.catalog.lookup(path, stat)
+            if cached:
+                job.metrics.data['cached'] = True
+                return cached
+        with job.metrics.phase('mime'):
+            # libmagic only if the header is not recognized, imported then
+            mime_type = discover.sniff(path) or importlib.import_module('magic').from_file(
+                path, mime=True)
+        info = None
+        if discover.is_video(mime_type):
+            with job.metrics.phase('probe'):
+                info = MyMediaInfo(job.src_file)
+            # video mime type without a video track: audio-only MP4
+            if not (info.width and info.height):
+                info = None
+        if self.catalog:
+            self.catalog.store(path, stat, mime_type, info)
+        return mime_type, info
+
+    def _write_metrics(self, job, dst, status, info):
+        if not self.metrics or self.args.dry:
+            return
+        job.metrics.data.update(file=job.src_file, dst=dst, status=status,
+                                bytes_in=job.stat.st_size if job.stat else
+                                os.path.getsize(job.src_file))
+        if status != 'exists' and os.path.exists(dst):
+            job.metrics.data['bytes_out'] = os.path.getsize(dst)
+        media_duration = info.duration
+        if self.args.duration and media_duration:
+            media_duration = min(media_duration, self.args.duration)
+        self.metrics.write(job.metrics.record(media_duration))
+
+    def _dst_name(self, base_name, dst_dir=None):
+        return os.path.join(dst_dir or self.args.dst_dir, f'{base_name}.MOV')
+
+    def _dst_names(self, job, info):
+        base_name = os.path.splitext(job.filename)[0]
+        if self.args.fnparams:
+            base_name = self._format_name(job, base_name, info)
+        return [self._dst_name(base_name, dst_dir) for dst_dir in self.args.dst_dirs]
+
+    def _log_state(self, job, state, dst=None, **data):
+        job.state = state
+        if dst:
+            job.dst = dst
+        if self.journal and not self.args.dry:
+            if dst:
+                data['dst'] = os.path.abspath(dst)
+            self.journal.write(job.src_file, state, **data)
+
+    def _find_dup(self, job):
+        """ return: True if the content was processed before, with --dedup-link
+        the earlier outputs are linked to the destinations """
+        with job.metrics.phase('dedup'):
+            dups = self.dedup.find(job.src_file, argsp.batch_params(self.args))
+        if not dups:
+            return False
+        src, dst = dups[0]
+        job.print(f'DUPLICATE {job.src_file} of {src}, output {dst}')
+        if self.args.dedup_link:
+            # --fnparams: keep the parameters part of the name
+            suffix = os.path.splitext(os.path.basename(dst))[0][
+                len(os.path.splitext(os.path.basename(src))[0]):] if self.args.fnparams else ''
+            for dst_dir in self.args.dst_dirs:
+                link = self._dst_name(os.path.splitext(job.filename)[0] + suffix, dst_dir)
+                if os.path.lexists(link):
+                    continue
+                if self.args.dry or dedup.link(dst, link):
+                    job.print(f'LINK {link} -> {dst}')
+        self._log_state(job, 'skipped', dst=dst, duplicate=src)
+        return True
+
+    def process_file(self, job):
+        try:
+            if self.dedup and self._find_dup(job):
+                return 0
+            _, mi = self.probe(job)
+            if mi is None or (self.args.where and not self.args.where(mi)):
+                self._log_state(job, 'skipped')
+                return 0
+            job.print(f'FILE {job.src_file}')
+            if self.pool:
+                return self._pool_file(job, mi)
+            return self._encode_file(job, mi)
+        finally:
+            # the log file, getvalue() still works
+            if isinstance(job.out, joblog.JobLog):
+                job.out.close()
+
+    def run_job(self, job):
+        """ process_file, with --max-jobs in a slot of the governor """
+        with self.governor.slot() if self.governor else contextlib.nullcontext():
+            return self.process_file(job)
+
+    def _pool_file(self, job, mi):
+        """ encode_file with the first free encoder of the pool accepting the file """
+        if self.args.fnparams:
+            # made before by another encoder of the pool
+            for enc in self.pool.candidates(mi):
+                job.enc = enc
+                dst_files = self._dst_names(job, mi)
+                if all(os.path.exists(dst) for dst in dst_files) and not self.args.dry:
+                    job.print(f'EXISTS {dst_files[0]}')
+                    self._log_state(job, 'skipped', dst=dst_files[0])
+                    return 0
+            job.debug.clear()
+        with self.pool.session(mi) as enc:
+            job.enc = enc
+            if enc is None:
+                job.print('NO ENCODER of the pool accepts the file')
+                self._log_state(job, 'skipped')
+                return 0
+            job.print(f'ENCODER {enc}')
+            job.metrics.data['enc'] = enc
+            return self._encode_file(job, mi)
+
+    def _encode_file(self, job, mi):
+        if self.args.res:
+            job.debug.append(f'res: {self.args.res}')
+
+        dst_files = self._dst_names(job, mi)
+        dst_file = dst_files[0]
+        missing = [dst for dst in dst_files if not os.path.exists(dst)]
+        for dst in sorted(set(dst_files) - set(missing)):
+            job.print(f'EXISTS {dst}')
+        if not missing:
+            if not self.args.dry:
+                self._write_metrics(job, dst_file, 'exists', mi)
+                self._log_state(job, 'skipped', dst=dst_file)
+                return 0
+
+        job_crf = self._job_opts(job)[0].crf
+        if self.args.target_quality:
+            job.debug.append(f'target quality: {" ".join(map(str, self.args.target_quality))}')
+        elif job_crf:
+            job.debug.append(f'crf: {job_crf}')
+        if self.args.preset:
+            job.debug.append(f'preset: {self.args.preset}')
+        if job.debug:
+            job.print('\n'.join(map(lambda s: f'> {s}', job.debug)))
+        mi.print(file=job.out)
+
+        # written under a temporary name, renamed when complete,
+        # single copies continue where they stopped
+        part = lib.part_name(dst_file)
+        if os.path.exists(part) and not (self.args.dry or self.args.copy):
+            job.print(f'REMOVE unfinished {part}')
+            os.remove(part)
+        extra = None
+        if self.args.proxy or self.args.thumbs:
+            extra = multi.MultiOutput(dst_file, self.args.proxy, self.args.thumbs)
+        if extra and not self.args.dry:
+            extra.remove_parts()
+        self._log_state(job, 'running', dst=dst_file)
+        start_time = timer()
+        try:
+            if self.args.copy:
+                with job.metrics.phase('copy'):
+                    rcode = self._copy(job, missing)
+            else:
+                rcode = self._transcode(job, part, mi, extra)
+            if rcode != 0:
+                job.print(f"{'copy' if self.args.copy else 'transcode'} failed with code: {rcode}")
+                job.metrics.data['rcode'] = rcode
+                self._write_metrics(job, dst_file, 'failed', mi)
+                self._log_state(job, 'failed', dst=dst_file, rcode=rcode)
+                raise JobFailed(job, rcode)
+            if not (self.args.dry or self.args.copy):
+                lib.publish(part, dst_file)
+                for path in extra.publish() if extra else ():
+                    job.print(f'EXTRA {path}')
+            if self.dedup and not self.args.dry:
+                self.dedup.add(job.src_file, missing if self.args.copy else [dst_file],
+                               argsp.batch_params(self.args))
+        finally:
+            if os.path.exists(part) and not self.args.copy:
+                os.remove(part)
+            if extra and not self.args.dry:
+                extra.remove_parts()
+        end_time = timer() - start_time
+        self._write_metrics(job, dst_file, 'done', mi)
+        self._log_state(job, 'done', dst=dst_file)
+        if not self.args.dry:
+            job.print(f"TIME {lib.format_time(end_time)}\n")
+        return end_time
+
+    def run_jobs(self, jobs):
+        """ run jobs in a thread pool, print the output of each job when it is done
+        return: summed time of jobs """
+        total = 0.0
+        with ThreadPoolExecutor(max_workers=self.args.max_jobs or self.args.jobs) as pool:
+            futures = {pool.submit(self.run_job, job): job for job in jobs}
+            try:
+                for future in as_completed(futures):
+                    job = futures[future]
+                    sys.stdout.write(job.out.getvalue())
+                    sys.stdout.flush()
+                    total += future.result()
+            except BaseException:
+                # failed job, Ctrl-C or SIGTERM: stop queued and running encodes
+                pool.shutdown(wait=False, cancel_futures=True)
+                runner.terminate_all()
+                raise
+        return total
+
+    def _find_files(self, path):
+        """ yield (path, stat), with --resume the files the journal does not record as
+        finished (files never reached before a crash have no record), with --run-plan
+        the files of the plan """
+        if self.args.run_plan:
+            for src_file in self.args.planned:
+                try:
+                    yield src_file, os.stat(src_file)
+                except FileNotFoundError:
+                    print(f'MISSING {src_file}')
+        elif os.path.isfile(path):
+            if not (self.args.resume and os.path.abspath(path) in self.args.finished):
+                yield path, os.stat(path)
+        else:
+            found = set()
+            for entry in discover.walk(path, self.args.recursive):
+                src_file = os.path.abspath(entry.path)
+                if self.args.resume and src_file in self.args.finished:
+                    continue
+                found.add(src_file)
+                yield entry.path, entry.stat()
+            for src_file in self.args.unfinished if self.args.resume else ():
+                if src_file not in found:
+                    print(f'MISSING {src_file}')
+
+    def find_jobs(self, path, buffered=False):
+        """ stat-only filters, sniffing and probing are done by process_file
+        buffered: collect job output in memory instead of printing it """
+        # discover phase: time spent since the previous job was found
+        start = timer()
+        for src_file, stat in self._find_files(path):
+            job = self.new_job(src_file, stat, buffered)
+            if job is None:
+                continue
+            job.metrics.add('discover', timer() - start)
+            yield job
+            start = timer()
+            if self.args.first:
+                break
+
+    def new_job(self, src_file, stat, buffered=False, progress=True):
+        """ return: queued Job of the file, None if the stat-only filters skip it
+        progress: buffered jobs print their progress lines with the file name """
+        if stat.st_size == 0 or stat.st_size < self.args.min_size * 2**20:
+            return None
+        if self.args.newer and stat.st_mtime < self.args.newer:
+            return None
+        filename = os.path.basename(src_file)
+        base_name = os.path.splitext(filename)[0]
+        # -r: the destination is flat, a name from another directory would overwrite
+        first = self.base_names.setdefault(base_name, os.path.abspath(src_file))
+        if first != os.path.abspath(src_file):
+            print(f'COLLISION {src_file}: same output name as {first}, skipped')
+            return None
+        # with --fnparams the name depends on media info, checked later
+        if not self.args.fnparams and not self.args.dry and all(
+                os.path.exists(self._dst_name(base_name, dst_dir))
+                for dst_dir in self.args.dst_dirs):
+            print(f'EXISTS {self._dst_name(base_name)}')
+            return None
+        log_path = None
+        if self.args.logs:
+            log_path = os.path.join(self.args.logs, f'{os.path.splitext(filename)[0]}.log')
+        out = joblog.JobLog(path=log_path, buffered=buffered,
+                            name=filename if buffered and progress else None)
+        job = Job(src_file, filename, out, stat=stat)
+        self._log_state(job, 'queued')
+        return job
+
+    def watch(self, path):
+        """ --watch: process or with --enqueue queue the settled new files of path,
+        -j at once, until interrupted """
+        watcher = watch.Watcher(path, self.args.recursive, self.args.settle, self.args.poll)
+        print(f"WATCH {path}{' (inotify)' if watcher.inotify else ''}")
+        with ThreadPoolExecutor(max_workers=self.args.max_jobs or self.args.jobs) as pool:
+            try:
+                for src_file, stat in watcher:
+                    job = self.new_job(src_file, stat, buffered=not self.args.enqueue)
+                    if job is None:
+                        continue
+                    if self.args.enqueue:
+                        self._enqueue(job)
+                    else:
+                        pool.submit(self._watch_job, job)
+            except BaseException:
+                pool.shutdown(wait=False, cancel_futures=True)
+                runner.terminate_all()
+                raise
+            finally:
+                watcher.close()
+
+    def _watch_job(self, job):
+        """ a failed job is reported, the watch goes on """
+        try:
+            self.run_job(job)
+        except JobFailed as ex:
+            job.print(f'FAILED {ex}')
+        except Exception as ex: # pylint: disable=broad-exception-caught
+            # the future is not looked at: an OSError of a file removed since it
+            # settled or a bug must not vanish with it
+            job.print(f'FAILED {job.src_file}: {ex!r}')
+            self._log_state(job, 'failed')
+        with self.output_lock:
+            sys.stdout.write(job.out.getvalue())
+            sys.stdout.flush()
+
+    def build_command(self, job):
+        """ return: command of the job as it would run now, None if it is skipped, a
+        copy, or found when it runs (--pool, --target-quality, --chunks, --pipe) """
+        entry = self._plan_job(job)
+        return entry.get('cmd') if entry else None
+
+    def _plan_job(self, job):
+        """ return: plan entry of a job, None if process_file would skip it """
+        job.probed = self.probe(job)
+        info = job.probed[1]
+        if info is None or (self.args.where and not self.args.where(info)):
+            return None
+        dst_files = self._dst_names(job, info)
+        # _format_name() notes are printed when the job runs
+        job.debug.clear()
+        if not self.args.dry and all(os.path.exists(dst) for dst in dst_files):
+            return None
+        entry = {'src': job.src_file, 'dst': dst_files}
+        if self.args.copy:
+            entry.update(plan.estimate_copy(job.stat.st_size))
+            return entry
+        if self.pool:
+            # estimated with the first encoder, the pool picks one when the job runs
+            job.enc = (self.pool.candidates(info) or [None])[0]
+            if job.enc is None:
+                return None
+        opts, enc_mod = self._job_opts(job)
+        command = encode.Command(opts, enc_mod, info)
+        job.enc = None
+        if self.args.remux and not command.compliance(job.src_file, self.args.max_bitrate):
+            entry.update(plan.estimate_copy(job.stat.st_size), remux=True,
+                         cmd=command.remux(job.src_file, lib.part_name(dst_files[0])))
+            job.metrics.data['predicted_seconds'] = entry['seconds']
+            return entry
+        entry.update(plan.estimate(command, opts.enc, self.args.jobs))
+        proxies = self._proxies(opts, info)
+        for proxy in proxies:
+            estimate = plan.estimate(proxy, 'x265', self.args.jobs)
+            entry['seconds'] = round(entry['seconds'] + estimate['seconds'], 1)
+            entry['size'] += estimate['size']
+        # encoder, crf and segments are found when the job runs, pipes use temporary files
+        if not (self.pool or self.args.target_quality or self.args.chunks > 1 or self.args.pipe):
+            part = lib.part_name(dst_files[0])
+            entry['cmd'] = command.build(job.src_file, part,
+                                         progress=bool(self.metrics) and not command.external)
+            if proxies or self.args.thumbs:
+                extra = multi.MultiOutput(dst_files[0], self.args.proxy, self.args.thumbs)
+                entry['cmd'] = extra.build(job.src_file, part, [command] + proxies,
+                                           progress=bool(self.metrics))
+        job.metrics.data['predicted_seconds'] = entry['seconds']
+        return entry
+
+    def plan_jobs(self, jobs):
+        """ probe all jobs, order them longest first, write the plan
+        return: jobs to run, none with --dry """
+        planned = []
+        for job in jobs:
+            # encoders print, keep a plan on stdout clean
+            with contextlib.redirect_stdout(sys.stderr):
+                entry = self._plan_job(job)
+            if entry is None:
+                self._log_state(job, 'skipped')
+            else:
+                planned.append((job, entry))
+        found = plan.makespan([entry['seconds'] for _, entry in planned], self.args.jobs)
+        planned.sort(key=lambda item: item[1]['seconds'], reverse=True)
+        entries = [entry for _, entry in planned]
+        plan.write(self.args.plan, argsp.strip_opts(self.args.batch_argv, argsp.PLAN_OPTS),
+                   self.args.jobs, entries)
+        makespan = plan.makespan([ent['seconds'] for ent in entries], self.args.jobs)
+        print(f"PLAN {len(entries)} jobs on {self.args.jobs} workers, estimated "
+              f"{lib.format_time(makespan)} "
+              f"longest first ({lib.format_time(found)} as found), "
+              f"output {sum(ent['size'] for ent in entries) / 2**30:.2f} GiB", file=sys.stderr)
+        return [] if self.args.dry else [job for job, _ in planned]
+
+    def enqueue_jobs(self, path):
+        """ queue the files process_file would handle, return: queued count """
+        return sum(self._enqueue(job) for job in self.find_jobs(path))
+
+    def _enqueue(self, job):
+        """ return: True if the job was queued """
+        _, info = self.probe(job)
+        if info is None or (self.args.where and not self.args.where(info)):
+            return False
+        if self.queue.enqueue(job.src_file, self.args.job_argv):
+            print(f'QUEUED {job.src_file}')
+            return True
+        return False
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+""" encoder speed/quality matrix over reference clips, to calibrate
+lib.CRF and the encoder presets per machine
+
+benchmark.py clip1.mp4 clip2.mov --enc x265 --crf 18 20 22 --preset slow medium \\
+    --fmt hevc dnxhr --profile hq hqx -t 10 --csv bench.csv --json bench.json
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+from argparse import Namespace
+from timeit import default_timer as timer
+from mymediainfo import MyMediaInfo
+import argsp
+import encode
+import lib
+import quality
+
+FIELDS = ('clip', 'fmt', 'enc', 'crf', 'preset', 'bits', 'profile', 'rcode', 'seconds',
+          'frames', 'fps', 'cpu', 'size', 'kbps', 'vmaf', 'ssim', 'psnr', 'pareto_speed',
+          'pareto_size')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Encoder speed/quality benchmark')
+    parser.add_argument('clips', nargs='+', help='Reference clips')
+    parser.add_argument('--fmt', nargs='+', default=['hevc'], choices=lib.FORMATS,
+                        help='Target formats (%(default)s)')
+    parser.add_argument('--enc', nargs='+', default=['x265'], choices=lib.ENCODERS,
+                        help='HEVC encoders (%(default)s)')
+    parser.add_argument('--crf', nargs='+', type=int,
+                        help='crf/quality values, default lib.CRF of the encoder')
+    parser.add_argument('--preset', nargs='+', help='HEVC presets, default by resolution')
+    parser.add_argument('--bits', nargs='+', type=int, choices=[8, 10], help='HEVC bit depths')
+    parser.add_argument('--profile', nargs='+',
+                        help='DNxHR/ProRes/CineForm profiles, used where valid')
+    parser.add_argument('--params', help='Params HEVC')
+    parser.add_argument('-t', type=float, dest='duration', help='Seconds of each clip')
+    parser.add_argument('--metric', choices=('auto', 'vmaf', 'ssim'), default='auto',
+                        help='Quality metric, ssim also gives psnr (%(default)s)')
+    parser.add_argument('--keep', metavar='DIR', help='Keep the encodes in DIR')
+    parser.add_argument('--csv', metavar='FILE', help='Write results as CSV')
+    parser.add_argument('--json', metavar='FILE', help='Write results and machine as JSON')
+    args = parser.parse_args()
+    for clip in args.clips:
+        if not os.path.isfile(clip):
+            sys.exit(f"Clip '{clip}' doesn't exist")
+    if args.metric == 'vmaf' and not quality.has_vmaf():
+        sys.exit('ffmpeg has no libvmaf')
+    args.vmaf = None if args.metric == 'auto' else args.metric == 'vmaf'
+    return args
+
+def matrix(args):
+    """ yield (fmt, enc, crf, preset, bits, profile) """
+    for fmt in args.fmt:
+        if fmt == 'hevc':
+            for enc in args.enc:
+                yield from itertools.product(
+                    [fmt], [enc], args.crf or [lib.CRF.get(enc) or lib.CRF['hevc']],
+                    args.preset or [None], args.bits or [None], [None])
+        else:
+            valid = argsp.encoder_module(fmt, None).PROFILES
+            profiles = [prof for prof in args.profile or [] if prof in valid]
+            for profile in profiles or [None]:
+                yield fmt, None, None, None, None, profile
+
+def options(args, combo):
+    """ encode.Command options of a combination """
+    fmt, _, crf, preset, bits, profile = combo
+    return Namespace(fmt=fmt, crf=crf, bits=bits, res=None, gop=None, all_i=False,
+                     params=args.params, preset=preset, tune=None, profile=profile,
+                     nometa=True, duration=args.duration)
+
+def run(args, clip, info, combo, out_dir):
+    """ encode clip with one combination, return: result dict """
+    command = encode.Command(options(args, combo), argsp.encoder_module(*combo[:2]), info)
+    if command.external:
+        print(f'SKIP {combo[1]}: not an ffmpeg encoder')
+        return None
+    name = '_'.join(str(val) for val in combo if val is not None)
+    dst = os.path.join(out_dir, f'{os.path.splitext(os.path.basename(clip))[0]}_{name}.MOV')
+    result = dict(zip(FIELDS, (clip,) + combo))
+    stats = {}
+    start = timer()
+    with open(f'{dst}.log', 'w', encoding='utf-8') as log:
+        result['rcode'] = lib.run_cmd(command.build(clip, dst, progress=True), out=log,
+                                      stats=stats)
+    result['seconds'] = round(timer() - start, 3)
+    if result['rcode'] == 0:
+        measure(args, result, stats, info, dst)
+    return result
+
+def measure(args, result, stats, info, dst):
+    """ speed, size and quality of a finished encode """
+    progress = stats.get('progress', {})
+    result['frames'] = int(progress.get('frame', 0))
+    result['fps'] = round(result['frames'] / result['seconds'], 2)
+    result['cpu'] = round(stats.get('utime', 0) + stats.get('stime', 0), 3)
+    result['size'] = os.path.getsize(dst)
+    media = info.duration
+    if progress.get('out_time_us', 'N/A') != 'N/A':
+        media = int(progress['out_time_us']) / 1e6
+    if media:
+        result['kbps'] = round(result['size'] * 8 / media / 1000, 1)
+    result.update(quality.measure(result['clip'], dst, (info.width, info.height), args.vmaf,
+                                  (None, args.duration)))
+
+def pareto(results, field, key, better):
+    """ set field of results not beaten in quality and key by another of the same clip
+    better: 1 if a higher key is better, -1 if lower """
+    score = quality_key(results)
+    for res in results:
+        if res.get(score) is None or res.get(key) is None:
+            continue
+        res[field] = not any(
+            other is not res and other['clip'] == res['clip']
+            and other.get(score) is not None and other.get(key) is not None
+            and other[score] >= res[score] and better * other[key] >= better * res[key]
+            and (other[score], other[key]) != (res[score], res[key])
+            for other in results)
+
+def quality_key(results):
+    for name in ('vmaf', 'ssim'):
+        if any(res.get(name) is not None for res in results):
+            return name
+    return 'vmaf'
+
+def report(results):
+    score = quality_key(results)
+    for clip in dict.fromkeys(res['clip'] for res in results):
+        print(f'\n{clip}  (* speed front, + size front)')
+        rows = sorted((res for res in results if res['clip'] == clip),
+                      key=lambda res: -(res.get(score) or 0))
+        for res in rows:
+            label = ' '.join(f'{key}={res[key]}' for key in FIELDS[1:7] if res[key] is not None)
+            mark = ('*' if res.get('pareto_speed') else ' ') + \
+                ('+' if res.get('pareto_size') else ' ')
+            if res['rcode'] != 0:
+                print(f'   {label}: failed with code {res["rcode"]}')
+                continue
+            print(f'{mark} {label}: {score} {res.get(score)} fps {res["fps"]} '
+                  f'cpu {res["cpu"]}s {res.get("kbps")} kb/s')
+
+def write(args, results):
+    if args.csv:
+        with open(args.csv, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(results)
+    if args.json:
+        machine = {'host': platform.node(), 'cpu': platform.processor() or platform.machine(),
+                   'cpus': os.cpu_count(), 'system': platform.platform()}
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({'machine': machine, 'metric': quality_key(results), 'results': results},
+                      file, indent=1)
+
+def main():
+    args = parse_args()
+    combos = list(matrix(args))
+    results = []
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as temp:
+        out_dir = args.keep or temp
+        os.makedirs(out_dir, exist_ok=True)
+        for clip in args.clips:
+            info = MyMediaInfo(clip)
+            for num, combo in enumerate(combos, 1):
+                print(f'RUN {num}/{len(combos)} {clip} '
+                      f'{" ".join(str(val) for val in combo if val is not None)}', flush=True)
+                result = run(args, clip, info, combo, out_dir)
+                if result is not None:
+                    results.append(result)
+    pareto(results, 'pareto_speed', 'fps', 1)
+    pareto(results, 'pareto_size', 'kbps', -1)
+    report(results)
+    write(args, results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+""" persistent probe catalog: MyMediaInfo fields and MIME type by file """
+
+import re
+import sqlite3
+import threading
+from dataclasses import fields
+from mymediainfo import MyMediaInfo
+
+INFO_FIELDS = tuple(f.name for f in fields(MyMediaInfo) if f.name != 'file_name')
+KEY_FIELDS = ('size', 'mtime_ns', 'inode')
+COLUMNS = ('path',) + KEY_FIELDS + ('mime', 'probed') + INFO_FIELDS
+
+OPERATORS = {
+    '=':  lambda a, b: a == b,
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>':  lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<':  lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+}
+TOKEN_RE = re.compile(r'"[^"]*"|\'[^\']*\'|>=|<=|!=|==|[=<>]|[^\s=<>!"\']+')
+
+class Catalog:
+    """ sqlite cache keyed by path, validated by size, mtime and inode """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        cols = [row[1] for row in self.db.execute('PRAGMA table_info(media)')]
+        if cols and tuple(cols) != COLUMNS:
+            # MyMediaInfo fields changed, start over
+            self.db.execute('DROP TABLE media')
+            cols = None
+        if not cols:
+            self.db.execute(f'CREATE TABLE media ({", ".join(COLUMNS)}, '
+                            'PRIMARY KEY (path))')
+            self.db.commit()
+
+    def lookup(self, path, stat):
+        """ return: (mime, MyMediaInfo or None) or None if unknown/changed """
+        with self.lock:
+            row = self.db.execute(f'SELECT {", ".join(COLUMNS[1:])} FROM media '
+                                  'WHERE path=?', (path,)).fetchone()
+        if row is None or row[:3] != _key(stat):
+            return None
+        mime, probed = row[3:5]
+        info = None
+        if probed:
+            info = MyMediaInfo.from_dict(path, dict(zip(INFO_FIELDS, row[5:])))
+        return mime, info
+
+    def store(self, path, stat, mime, info=None):
+        values = (path,) + _key(stat) + (mime, info is not None)
+        if info is not None:
+            values += tuple(info.to_dict().values())
+        else:
+            values += (None,) * len(INFO_FIELDS)
+        with self.lock:
+            self.db.execute(f'INSERT OR REPLACE INTO media VALUES '
+                            f'({", ".join("?" * len(COLUMNS))})', values)
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def _key(stat):
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+def parse_where(expr):
+    """ 'bit_depth=10 and height>=2160 or format!=HEVC' -> predicate(info)
+    'and' binds tighter than 'or', strings compare case insensitive """
+    tokens = TOKEN_RE.findall(expr)
+    alternatives = [[]]
+    pos = 0
+    while pos < len(tokens):
+        if len(tokens) - pos < 3:
+            raise ValueError(f"incomplete condition in '{expr}'")
+        name, oper, value = tokens[pos:pos + 3]
+        if name not in INFO_FIELDS:
+            raise ValueError(f"unknown field '{name}', use one of {INFO_FIELDS}")
+        if oper not in OPERATORS:
+            raise ValueError(f"bad operator '{oper}' after '{name}'")
+        alternatives[-1].append((name, oper, value.strip('"\'')))
+        pos += 3
+        if pos < len(tokens):
+            match tokens[pos].lower():
+                case 'and':
+                    pass
+                case 'or':
+                    alternatives.append([])
+                case _:
+                    raise ValueError(f"expected and/or, got '{tokens[pos]}'")
+            pos += 1
+            if pos == len(tokens):
+                raise ValueError(f"dangling and/or in '{expr}'")
+
+    def predicate(info):
+        return any(all(_compare(getattr(info, name), oper, value)
+                       for name, oper, value in conds)
+                   for conds in alternatives)
+    return predicate
+
+def _compare(actual, oper, value):
+    if actual is None:
+        return oper == '!='
+    try:
+        return OPERATORS[oper](float(actual), float(value))
+    except (TypeError, ValueError):
+        return OPERATORS[oper](str(actual).casefold(), value.casefold())
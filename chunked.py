@@ -0,0 +1,126 @@
+""" segment-parallel encoding of long files
+
+Split the source at keyframes into segments of about equal duration,
+encode them in parallel, join them with the concat demuxer and remux
+audio and metadata from the source once.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from bisect import bisect_left
+import lib
+import pktindex
+from pktindex import FFPROBE
+import runner
+
+# segments are not shorter than this, seconds
+MIN_SEGMENT = 10.0
+
+def packets(src):
+    """ return: sorted pts (seconds) of video packets, sorted pts of keyframes """
+    pkt_index = pktindex.index(src)
+    return pkt_index.pts, pkt_index.key_times()
+
+def split(pts, keys, count, limit=None):
+    """ count: wanted segments, limit: seconds from the start
+    return: [(seek seconds, frames, duration)], segments start at the
+    keyframe nearest to each fraction of the duration, one segment without
+    keyframes, none without packets """
+    if not pts:
+        return []
+    if limit:
+        pts = pts[:bisect_left(pts, pts[0] + limit)]
+    step = (pts[-1] - pts[0]) / count
+    starts = [pts[0]]
+    for idx in range(1, count if keys else 1):
+        target = pts[0] + idx * step
+        key = min(keys, key=lambda k, t=target: abs(k - t))
+        if key - starts[-1] >= MIN_SEGMENT and pts[-1] - key >= MIN_SEGMENT:
+            starts.append(key)
+    frame = pts[1] - pts[0] if len(pts) > 1 else 0.0
+    ends = starts[1:] + [pts[-1] + frame]
+    # seek half a frame before the keyframe so rounding can't skip it
+    return [(start - frame / 2 if idx else 0,
+             bisect_left(pts, end) - bisect_left(pts, start),
+             end - start)
+            for idx, (start, end) in enumerate(zip(starts, ends))]
+
+def stream_info(path):
+    """ return: video packets, duration in seconds """
+    cmd = FFPROBE + ['-count_packets', '-show_entries',
+                     'stream=nb_read_packets,duration', '-of', 'json', path]
+    res = subprocess.run(cmd, capture_output=True, check=True, text=True)
+    stream = json.loads(res.stdout)['streams'][0]
+    return int(stream['nb_read_packets']), float(stream.get('duration', 0))
+
+class ChunkedEncode:
+    """ command: encode.Command, out: text stream for output """
+
+    def __init__(self, command, src, dst, out=None):
+        self.command = command
+        self.src = src
+        self.dst = dst
+        self.out = out
+
+    def run(self, count, dry=False, **kwargs):
+        """ count: segments, kwargs: stats, timeout (per segment)
+        return: exit code, 1 if the output does not match the source """
+        if self.command.external:
+            print(f'CHUNKS not supported by {self.command.encoder.CMD[0]}', file=self.out)
+            return 1
+        pts, keys = packets(self.src)
+        segments = split(pts, keys, count, self.command.opts.duration)
+        if not segments:
+            # audio only or broken, nothing to split: the whole file at once
+            print('CHUNKS no video packets, one encode', file=self.out)
+            return lib.run_cmd(self.command.build(self.src, self.dst), dry=dry, out=self.out,
+                               **kwargs)
+        frames = sum(seg[1] for seg in segments)
+        print(f'CHUNKS {len(segments)} segments, {frames} frames', file=self.out)
+
+        workdir = tempfile.mkdtemp(prefix='.chunks-', dir=os.path.dirname(self.dst) or '.')
+        try:
+            rcode = self._encode(workdir, segments, dry, kwargs)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        if rcode != 0 or dry:
+            return rcode
+        return self.check(pts[:frames])
+
+    def _encode(self, workdir, segments, dry, kwargs):
+        names = [os.path.join(workdir, f'{idx:04d}.nut') for idx in range(len(segments))]
+        cmds = [self.command.build(self.src, name, segment=seg)
+                for name, seg in zip(names, segments)]
+        list_file = os.path.join(workdir, 'list.txt')
+        concat = self.command.concat(list_file, self.src, self.dst)
+        for cmd in cmds:
+            print(f"COMMAND: {' '.join(cmd)}", file=self.out)
+        if dry:
+            print(f"COMMAND: {' '.join(concat)}", file=self.out)
+            return 0
+
+        codes = runner.run_sync(runner.run_many(cmds, fail_fast=True, out=self.out, **kwargs))
+        failed = [code for code in codes if code != 0]
+        if failed:
+            return failed[0] or 1
+        with open(list_file, 'w', encoding='utf-8') as file:
+            # durations from the source timeline, the segments may round them
+            for name, seg in zip(names, segments):
+                file.write(f"file '{os.path.basename(name)}'\nduration {seg[2]:.6f}\n")
+        return lib.run_cmd(concat, out=self.out, stats=kwargs.get('stats'))
+
+    def check(self, pts):
+        """ pts: source video packets in the encoded range
+        return: 0 if frame count and duration of the output match """
+        frame = pts[1] - pts[0] if len(pts) > 1 else 0.04
+        src_duration = pts[-1] - pts[0] + frame
+        out_frames, out_duration = stream_info(self.dst)
+        print(f'CHECK frames {out_frames}/{len(pts)} '
+              f'duration {out_duration:.3f}/{src_duration:.3f}', file=self.out)
+        if out_frames != len(pts) or abs(out_duration - src_duration) > 2 * frame:
+            print('CHECK failed: output does not match the source', file=self.out)
+            return 1
+        return 0
@@ -0,0 +1,112 @@
+""" content dedup index: outputs already made from a source, by fingerprint
+
+A fingerprint is the size and a hash of the first, middle and last block,
+read in three small reads. Where it matches a different source path the
+full hashes are compared, computed once and kept.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import fastcopy
+
+BLOCK = 2**16
+
+def fingerprint(path):
+    digest = hashlib.blake2b(digest_size=16)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        for offset in sorted({0, max(size // 2 - BLOCK // 2, 0), max(size - BLOCK, 0)}):
+            digest.update(os.pread(fd, BLOCK, offset))
+    finally:
+        os.close(fd)
+    return f'{size:x}-{digest.hexdigest()}'
+
+def full_hash(path):
+    return f'{fastcopy.HASH_NAME}:{fastcopy.file_hash(path)}'
+
+def link(target, path):
+    """ hard link path to target, a symlink across filesystems or where hard
+    links are not permitted, return: False if path exists (made meanwhile) """
+    try:
+        os.link(target, path)
+    except FileExistsError:
+        return False
+    except OSError as ex:
+        if ex.errno not in (errno.EXDEV, errno.EPERM):
+            raise
+        try:
+            os.symlink(target, path)
+        except FileExistsError:
+            return False
+    return True
+
+class Index:
+    """ sqlite: fingerprint -> source, output, parameters """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        # full hashes of sources without outputs yet
+        self.hashes = {}
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS outputs (fingerprint, full_hash, src, dst, '
+                        'params, time, PRIMARY KEY (dst))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS fingerprints ON outputs (fingerprint)')
+        self.db.commit()
+
+    def find(self, path, params):
+        """ params: dict of encoder parameters
+        return: [(src, dst)] of existing outputs made from the same content """
+        src = os.path.abspath(path)
+        finger = fingerprint(src)
+        with self.lock:
+            rows = self.db.execute('SELECT src, dst, full_hash FROM outputs '
+                                   'WHERE fingerprint=? AND params=?',
+                                   (finger, _params(params))).fetchall()
+        rows = [row for row in rows if os.path.exists(row[1])]
+        if all(row[0] == src for row in rows):
+            return [row[:2] for row in rows]
+        # the same fingerprint from another source: compare the content
+        own = full_hash(src)
+        found = []
+        for row_src, dst, row_hash in rows:
+            if row_hash is None and row_src != src and os.path.exists(row_src):
+                row_hash = full_hash(row_src)
+                self._set_hash(row_src, row_hash)
+            # source gone without a full hash: the fingerprint has to do
+            if row_src == src or row_hash in (own, None):
+                found.append((row_src, dst))
+        self.hashes[src] = own
+        return found
+
+    def add(self, path, dsts, params):
+        """ record outputs made from path with params """
+        src = os.path.abspath(path)
+        finger = fingerprint(src)
+        with self.lock:
+            row = self.db.execute('SELECT full_hash FROM outputs WHERE src=? AND fingerprint=?',
+                                  (src, finger)).fetchone()
+            known = self.hashes.pop(src, None) or (row and row[0])
+            self.db.executemany('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?)',
+                                [(finger, known, src, os.path.abspath(dst), _params(params),
+                                  time.time()) for dst in dsts])
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _set_hash(self, src, value):
+        with self.lock:
+            self.db.execute('UPDATE outputs SET full_hash=? WHERE src=?', (value, src))
+            self.db.commit()
+
+def _params(params):
+    return json.dumps(params, sort_keys=True)
@@ -0,0 +1,60 @@
+""" cheap-first file discovery: directory walk and container sniffing """
+
+import os
+
+HEADER_SIZE = 200
+
+# offset, magic, mime type
+SIGNATURES = (
+    (4, b'ftyp', 'video/mp4'),
+    (4, b'moov', 'video/quicktime'),
+    (4, b'mdat', 'video/quicktime'),
+    (4, b'wide', 'video/quicktime'),
+    (4, b'free', 'video/quicktime'),
+    (4, b'skip', 'video/quicktime'),
+    (0, b'\x06\x0e\x2b\x34\x02\x05\x01\x01', 'application/mxf'),
+    (0, b'\x1a\x45\xdf\xa3', 'video/x-matroska'),
+    (8, b'AVI ', 'video/x-msvideo'),
+    (0, b'\x00\x00\x01\xba', 'video/mpeg'),
+    (0, b'\x30\x26\xb2\x75\x8e\x66\xcf\x11', 'video/x-ms-asf'),
+    (0, b'FLV\x01', 'video/x-flv'),
+    # sidecars
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'\x89PNG', 'image/png'),
+    (0, b'<?xml', 'text/xml'),
+    (0, b'\xef\xbb\xbf<?xml', 'text/xml'),
+    (8, b'WAVE', 'audio/x-wav'),
+)
+# ftyp brands of ISO BMFF files without video
+FTYP_OTHER = {
+    b'heic': 'image/heic', b'heix': 'image/heic', b'mif1': 'image/heif',
+    b'avif': 'image/avif', b'M4A ': 'audio/mp4', b'M4B ': 'audio/mp4',
+}
+# sync byte positions of 2 packets: MPEG-TS, M2TS (4 byte timecode, AVCHD)
+TS_SYNC = ((0, 188), (4, 196))
+
+def is_video(mime):
+    return bool(mime) and (mime.startswith('video') or mime == 'application/mxf')
+
+def sniff(path):
+    """ mime type by the first bytes of a file, None if not recognized """
+    with open(path, 'rb') as file:
+        head = file.read(HEADER_SIZE)
+    for offset, magic, mime in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            if magic == b'ftyp':
+                return FTYP_OTHER.get(head[8:12], mime)
+            return mime
+    for first, second in TS_SYNC:
+        if head[first:first + 1] == head[second:second + 1] == b'\x47':
+            return 'video/mp2t'
+    return None
+
+def walk(path, recursive=False):
+    """ yield os.DirEntry of regular files, stat() is cached by the entry """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                yield entry
+            elif recursive and entry.is_dir(follow_symlinks=False):
+                yield from walk(entry.path, recursive)
@@ -55,8 +55,6 @@ class Encoder(BaseEncoder):
     can_scale = True
 
     def __init__(self, vid):
-        print(f'hevc_nvenc idx: {vid.idx()}')
-
         self.params = {
             'c:v': 'hevc_nvenc',
             'preset:v': vid.preset or PRESETS.get(vid.res, DEFAULT_PRESET),
@@ -40,8 +40,6 @@ class Encoder(BaseEncoder):
     can_scale = False
 
     def __init__(self, vid):
-        print(f'x265 idx: {vid.idx()}')
-
         self.params = {
             'c:v': 'libx265',
             'preset': vid.preset or PRESETS.get(vid.res, PRESET_DEFAULT),
@@ -0,0 +1,224 @@
+""" encoder command lines from cli options and media info """
+
+import lib
+import pktindex
+
+FFMPEG = ['ffmpeg', '-hide_banner', '-nostdin']
+FFMPEG_IN = FFMPEG + ['-ignore_editlist', '1']
+# mediainfo format profile of HEVC targets by Video.idx()
+HEVC_PROFILES = {
+    'yuv420:8':  'Main',
+    'yuv420:10': 'Main 10',
+    'yuv422:8':  'Format Range',
+    'yuv422:10': 'Format Range',
+}
+
+class Command:
+    """ commands for one source
+    opts: cli args (fmt, crf, bits, res, gop, all_i, params, preset, tune,
+    profile, nometa, duration), enc_mod: encoder module """
+
+    def __init__(self, opts, enc_mod, info):
+        self.opts = opts
+        self.info = info
+        self.encoder = enc_mod.Encoder(self.video())
+        # own cli (nvencc, vceencc), not ffmpeg
+        self.external = hasattr(self.encoder, 'CMD')
+
+    def video(self):
+        info = self.info
+        return lib.Video(
+            bits = self.opts.bits or 10,
+            bits_in = info.bit_depth,
+            crf = self.opts.crf,
+            gop = lib.gop(info.frame_rate, self.opts.gop),
+            all_i = self.opts.all_i,
+            params = self.opts.params,
+            preset = self.opts.preset,
+            tune = self.opts.tune,
+            color_format = info.color_format,
+            frame_rate = info.frame_rate,
+            profile = self.opts.profile,
+            res = self.opts.res or info.width,
+            color_primaries = info.color_primaries,
+            matrix_coefficients = info.matrix_coefficients,
+            transfer_characteristics = info.transfer_characteristics,
+        )
+
+    def need_scale(self):
+        return bool(self.opts.res and self.opts.res < self.info.height)
+
+    def filters(self):
+        need_scale = self.need_scale()
+        filter_v = list(self.encoder.get_filter(scale=need_scale))
+        if need_scale and not self.encoder.can_scale:
+            filter_v.append({'scale': f'w=-2:h={self.opts.res}:{lib.DSCALE_FLAGS}'})
+        return filter_v
+
+    def audio_params(self):
+        """ return: ffmpeg output params for audio, None if no audio """
+        match self.info.audio_format:
+            case None:
+                return None
+            case 'PCM Little / Signed':
+                return {'c:a': 'copy'}
+            case _:
+                if self.opts.fmt == 'dnxhr':
+                    return {'c:a': 'pcm_s16le', 'ar': '48000'}
+                return {'c:a': 'copy'}
+
+    def metadata_params(self, idx=0):
+        """ return: ffmpeg params to map metadata of input idx """
+        params = {
+            'movflags': 'use_metadata_tags', # mov, mp4
+            'map_metadata': f'{idx}:g',
+            'map_metadata:s:v': f'{idx}:s:v',
+        }
+        if self.info.audio_format:
+            params['map_metadata:s:a'] = f'{idx}:s:a'
+        return params
+
+    def video_params(self):
+        """ return: ffmpeg output params of the video encoder """
+        params = dict(self.encoder.get_params())
+        # All-intra
+        if self.opts.all_i:
+            params['g:v'] = 0
+        return params
+
+    def output_params(self):
+        """ return: ffmpeg output params of the whole file: video, metadata, audio """
+        params = self.video_params()
+        if not self.opts.nometa:
+            params.update(self.metadata_params())
+        audio = self.audio_params()
+        if audio is not None:
+            params.update(audio)
+        if self.opts.duration:
+            params['t'] = self.opts.duration
+        return params
+
+    def build(self, src, dst, segment=None, progress=False):
+        """ segment: (seek seconds, frames, ...), video only, no seek if 0
+        progress: ffmpeg -progress key=value lines to stdout """
+        if self.external:
+            return self._build_external(src, dst)
+        cmd = FFMPEG_IN.copy()
+        params = self.video_params()
+
+        # input
+        params_in = {}
+        if hasattr(self.encoder, 'get_params_in'):
+            params_in.update(self.encoder.get_params_in())
+        if segment and segment[0]:
+            params_in['ss'] = f'{segment[0]:.6f}'
+        for key, val in params_in.items():
+            cmd.extend([f'-{key}', val if isinstance(val, str) else str(val)])
+        cmd.extend(['-i', src])
+
+        if segment:
+            cmd.append('-an')
+            params['frames:v'] = segment[1]
+        else:
+            params = self.output_params()
+            if self.audio_params() is None:
+                cmd.append('-an')
+
+        filter_v = self.filters()
+        if filter_v:
+            cmd.extend(['-filter:v', lib.join_filters(filter_v)])
+
+        # output
+        for key, val in params.items():
+            cmd.extend([f'-{key}', val if isinstance(val, str) else str(val)])
+        if progress:
+            cmd.extend(['-progress', 'pipe:1'])
+        cmd.append(dst)
+        return cmd
+
+    def concat(self, list_file, src, dst):
+        """ join encoded video segments losslessly, audio and metadata from src """
+        return self.mux(['-f', 'concat', '-safe', '0', '-i', list_file], src, dst)
+
+    def mux(self, video_in, src, dst):
+        """ video_in: input args of encoded video, audio and metadata from src """
+        cmd = FFMPEG + video_in
+        cmd += ['-ignore_editlist', '1', '-i', src, '-map', '0:v']
+        params = {'c:v': 'copy'}
+        if not self.opts.nometa:
+            params.update(self.metadata_params(idx=1))
+        audio = self.audio_params()
+        if audio is not None:
+            cmd.extend(['-map', '1:a'])
+            params.update(audio)
+        if self.opts.duration:
+            params['t'] = self.opts.duration
+        for key, val in params.items():
+            cmd.extend([f'-{key}', val if isinstance(val, str) else str(val)])
+        cmd.append(dst)
+        return cmd
+
+    def compliance(self, src, max_bitrate=None):
+        """ check the source against the HEVC target, max_bitrate: Mbps
+        return: reasons it does not meet it, none: a stream copy will do """
+        info, video = self.info, self.video()
+        reasons = []
+        if info.format != 'HEVC':
+            reasons.append(f'format {info.format}')
+        if info.bit_depth != video.bits:
+            reasons.append(f'bit depth {info.bit_depth}')
+        if video.idx() not in HEVC_PROFILES:
+            reasons.append(f'color format {info.color_format}')
+        elif (info.format_profile or '').split('@')[0] != HEVC_PROFILES[video.idx()]:
+            reasons.append(f'profile {info.format_profile}')
+        if self.need_scale():
+            reasons.append(f'height {info.height}')
+        if max_bitrate and not (info.bit_rate and info.bit_rate <= max_bitrate):
+            reasons.append(f'bit rate {info.bit_rate}')
+        if not reasons and (video.all_i or video.gop):
+            pkt_index = pktindex.index(src)
+            keys = pkt_index.keys
+            if video.all_i and len(keys) != len(pkt_index):
+                reasons.append('not all intra')
+            elif video.gop and any(next_key - key > video.gop for key, next_key in
+                                   zip(keys, list(keys[1:]) + [len(pkt_index)])):
+                reasons.append(f'gop over {video.gop}')
+        return reasons
+
+    def remux(self, src, dst):
+        """ stream copy of a source meeting the target, see compliance() """
+        cmd = FFMPEG + ['-i', src, '-map', '0:v:0']
+        params = {'c:v': 'copy'}
+        if not self.opts.nometa:
+            params.update(self.metadata_params())
+        audio = self.audio_params()
+        if audio is not None:
+            cmd.extend(['-map', '0:a'])
+            params.update(audio)
+        if self.opts.duration:
+            params['t'] = self.opts.duration
+        for key, val in params.items():
+            cmd.extend([f'-{key}', val if isinstance(val, str) else str(val)])
+        cmd.append(dst)
+        return cmd
+
+    def _build_external(self, src, dst):
+        cmd = self.encoder.CMD.copy()
+        params = dict(self.encoder.get_params())
+        if hasattr(self.encoder, 'get_params_in'):
+            for key, val in self.encoder.get_params_in().items():
+                cmd.extend([f'-{key}', str(val)])
+        cmd.extend(['-i', src])
+        if not self.opts.nometa:
+            params['-metadata'] = 'copy'
+            params['-video-metadata'] = 'copy'
+            params['-audio-metadata'] = 'copy'
+        if self.info.audio_format:
+            params['-audio-codec'] = 'copy'
+        cmd.extend(self.filters())
+        if self.opts.duration:
+            params['-frames'] = int(self.opts.duration*float(self.info.frame_rate))
+        for key, val in params.items():
+            cmd.extend([f'-{key}', val if isinstance(val, str) else str(val)])
+        cmd.extend(['-o', dst])
+        return cmd
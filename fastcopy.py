@@ -0,0 +1,195 @@
+""" file copy in the kernel: reflink, copy_file_range, sendfile, then
+read/write with a large page aligned buffer; resumes partial copies
+
+fan_out() reads a source once for several destinations and hashes it
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import fcntl
+import hashlib
+import mmap
+import os
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# bytes per call, buffer size
+BLOCK = 8 * 2**20
+# bytes compared at the end of a partial copy before resuming
+VERIFY = 2**20
+FICLONE = getattr(fcntl, 'FICLONE', 0x40049409)
+# not supported for these files, try the next method
+UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY,
+               errno.EBADF, errno.ETXTBSY}
+
+# manifest file extension, b2sum/xxhsum -c compatible
+HASH_NAME = 'xxh128' if xxhash else 'b2'
+
+def new_hash():
+    return xxhash.xxh3_128() if xxhash else hashlib.blake2b()
+
+class Copy:
+    """ copy of src to dst, dst is continued if it starts like src """
+
+    def __init__(self, src, dst):
+        self.src = src
+        self.dst = dst
+        self.size = 0
+        self.offset = 0
+        self.method = None
+
+    def run(self):
+        """ return: bytes copied now, method, offset resumed from """
+        src_fd = os.open(self.src, os.O_RDONLY)
+        try:
+            dst_fd = os.open(self.dst, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                self.size = os.fstat(src_fd).st_size
+                start = self.offset = self.resume_offset(src_fd, dst_fd)
+                os.ftruncate(dst_fd, self.offset)
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(src_fd, self.offset, 0, os.POSIX_FADV_SEQUENTIAL)
+                for method in (self._reflink, self._copy_file_range, self._sendfile,
+                               self._read_write):
+                    try:
+                        method(src_fd, dst_fd)
+                    except OSError as ex:
+                        if ex.errno not in UNSUPPORTED:
+                            raise
+                        continue
+                    self.method = method.__name__.lstrip('_')
+                    break
+                if self.offset != self.size:
+                    raise OSError(errno.EIO, f'{self.src} changed while copied')
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+        return self.size - start, self.method, start
+
+    def resume_offset(self, src_fd, dst_fd):
+        """ length of dst that can be kept, checked at its last full block """
+        done = os.fstat(dst_fd).st_size
+        offset = done - done % VERIFY
+        if done > self.size or offset == 0:
+            return 0
+        if os.pread(src_fd, VERIFY, offset - VERIFY) != os.pread(dst_fd, VERIFY, offset - VERIFY):
+            return 0
+        return offset
+
+    def _reflink(self, src_fd, dst_fd):
+        # btrfs, XFS: shares the extents, whole files only
+        if self.offset:
+            raise OSError(errno.EINVAL, 'partial')
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        self.offset = self.size
+
+    def _copy_file_range(self, src_fd, dst_fd):
+        while self.offset < self.size:
+            count = os.copy_file_range(src_fd, dst_fd, min(BLOCK, self.size - self.offset),
+                                       self.offset, self.offset)
+            if count == 0:
+                break
+            self.offset += count
+
+    def _sendfile(self, src_fd, dst_fd):
+        os.lseek(dst_fd, self.offset, os.SEEK_SET)
+        while self.offset < self.size:
+            count = os.sendfile(dst_fd, src_fd, self.offset, min(BLOCK, self.size - self.offset))
+            if count == 0:
+                break
+            self.offset += count
+
+    def _read_write(self, src_fd, dst_fd):
+        with mmap.mmap(-1, BLOCK) as buf, memoryview(buf) as view:
+            while self.offset < self.size:
+                count = os.preadv(src_fd, [buf], self.offset)
+                if count == 0:
+                    break
+                written = 0
+                while written < count:
+                    written += os.pwrite(dst_fd, view[written:count], self.offset + written)
+                if hasattr(os, 'posix_fadvise'):
+                    # read once, keep the page cache for others
+                    os.posix_fadvise(src_fd, self.offset, count, os.POSIX_FADV_DONTNEED)
+                self.offset += count
+
+def copy(src, dst):
+    """ return: bytes copied now, method, offset resumed from """
+    return Copy(src, dst).run()
+
+def fan_out(src, dsts):
+    """ read src once, write it to all dsts at the same time
+    return: bytes, hex digest of src """
+    digest = new_hash()
+    src_fd = os.open(src, os.O_RDONLY)
+    dst_fds = []
+    try:
+        for dst in dsts:
+            dst_fds.append(os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644))
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(src_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        with ThreadPoolExecutor(max_workers=len(dst_fds)) as pool:
+            size = _fan_out(src_fd, dst_fds, digest, pool)
+        for fd in dst_fds:
+            os.fsync(fd)
+    finally:
+        for fd in dst_fds + [src_fd]:
+            os.close(fd)
+    return size, digest.hexdigest()
+
+def _fan_out(src_fd, dst_fds, digest, pool):
+    # two buffers: the next block is read and hashed while the last is written
+    with mmap.mmap(-1, BLOCK) as buf1, mmap.mmap(-1, BLOCK) as buf2:
+        buffers = [[buf1, None, []], [buf2, None, []]]
+        offset = 0
+        try:
+            while True:
+                _release(buffers[0])
+                buf, _, writes = buffers[0]
+                count = os.preadv(src_fd, [buf], offset)
+                if count == 0:
+                    break
+                view = buffers[0][1] = memoryview(buf)[:count]
+                writes[:] = [pool.submit(_write_all, fd, view, offset) for fd in dst_fds]
+                digest.update(view)
+                offset += count
+                buffers.reverse()
+        finally:
+            for buffer in buffers:
+                _release(buffer)
+    return offset
+
+def _release(buffer):
+    """ wait for the writes of a buffer, then it can be reused """
+    _, view, writes = buffer
+    for write in writes:
+        write.result()
+    writes.clear()
+    if view is not None:
+        view.release()
+        buffer[1] = None
+
+def _write_all(fd, view, offset):
+    written = 0
+    while written < len(view):
+        written += os.pwrite(fd, view[written:], offset + written)
+
+def file_hash(path):
+    """ hex digest of the file as on disk, not from the page cache """
+    digest = new_hash()
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        with mmap.mmap(-1, BLOCK) as buf:
+            offset = 0
+            while count := os.preadv(fd, [buf], offset):
+                digest.update(memoryview(buf)[:count])
+                offset += count
+    finally:
+        os.close(fd)
+    return digest.hexdigest()
@@ -0,0 +1,149 @@
+""" adaptive job count: between min and max jobs by CPU, memory and IO
+pressure (PSI, /proc/pressure), load average and available memory
+
+Running encodes are never stopped, a lower limit holds back the next
+ones. Pressure, high load or too little available memory lowers the
+limit by one job once the previous step took effect; after RAISE_AFTER
+seconds of calm with jobs waiting it is raised by one. Without PSI (old
+kernels, some containers) load and memory alone decide.
+"""
+
+import ctypes
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds between samples
+INTERVAL = 2.0
+# seconds of calm before one more job
+RAISE_AFTER = 10.0
+# PSI 'some' avg10, %: lower the limit above HIGH, raise only below LOW
+HIGH = {'cpu': 80.0, 'memory': 10.0, 'io': 40.0}
+LOW = {'cpu': 20.0, 'memory': 1.0, 'io': 10.0}
+# 1 minute load average per CPU
+LOAD_HIGH = 1.5
+LOAD_LOW = 0.9
+# fraction of the memory to keep available, twice that to raise
+MEM_RESERVE = 0.1
+
+IOPRIO_CLASSES = {'best-effort': 2, 'idle': 3}
+# ioprio_set(2) syscall numbers
+IOPRIO_SET = {'x86_64': 251, 'aarch64': 30, 'i686': 289, 'armv7l': 314, 'ppc64le': 273}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+# lowest level of the best-effort class
+IOPRIO_LEVEL = 7
+
+def pressure(resource):
+    """ return: 'some' avg10 % of /proc/pressure/resource, None without PSI """
+    try:
+        with open(f'/proc/pressure/{resource}', encoding='ascii') as file:
+            line = file.readline()
+    except OSError:
+        return None
+    fields = dict(field.split('=') for field in line.split()[1:])
+    return float(fields['avg10'])
+
+def memory():
+    """ return: available, total memory in bytes """
+    values = {}
+    with open('/proc/meminfo', encoding='ascii') as file:
+        for line in file:
+            name, value = line.split(':')
+            values[name] = int(value.split()[0]) * 1024
+    return values.get('MemAvailable', values['MemFree']), values['MemTotal']
+
+def sample():
+    """ return: {cpu, memory, io: PSI % or None, load: per CPU, available: fraction} """
+    available, total = memory()
+    values = {name: pressure(name) for name in HIGH}
+    values['load'] = os.getloadavg()[0] / (os.cpu_count() or 1)
+    values['available'] = available / total
+    return values
+
+def pressed(values):
+    """ return: reason to lower the limit, None if there is none """
+    for name, high in HIGH.items():
+        if values[name] is not None and values[name] > high:
+            return f'{name} pressure {values[name]:.1f}%'
+    if values['available'] < MEM_RESERVE:
+        return f"available memory {values['available']:.0%}"
+    if values['load'] > LOAD_HIGH:
+        return f"load {values['load']:.2f} per CPU"
+    return None
+
+def calm(values):
+    return (all(values[name] is None or values[name] < low for name, low in LOW.items())
+            and values['available'] >= 2 * MEM_RESERVE and values['load'] < LOAD_LOW)
+
+def lower_priority(nice=0, ionice=None):
+    """ nice and ionice class (IOPRIO_CLASSES) of this process and the encoders it
+    starts, OSError if ionice is not supported """
+    if nice:
+        os.nice(nice)
+    if ionice:
+        number = IOPRIO_SET.get(platform.machine())
+        if number is None:
+            raise OSError(f'no ioprio_set on {platform.machine()}')
+        libc = ctypes.CDLL(None, use_errno=True)
+        prio = IOPRIO_CLASSES[ionice] << IOPRIO_CLASS_SHIFT | IOPRIO_LEVEL
+        if libc.syscall(number, IOPRIO_WHO_PROCESS, 0, prio) < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+class Governor:
+    """ job slots, the limit starts at min_jobs """
+
+    def __init__(self, min_jobs, max_jobs):
+        self.min_jobs = min_jobs
+        self.max_jobs = max_jobs
+        self.limit = min_jobs
+        self.running = 0
+        self.cond = threading.Condition()
+        # monotonic times of the last sample and the start of the calm
+        self.sampled = None
+        self.calm_since = None
+
+    def update(self):
+        """ sample at most every INTERVAL and adjust the limit, with cond held """
+        now = time.monotonic()
+        if self.sampled is not None and now - self.sampled < INTERVAL:
+            return
+        self.sampled = now
+        values = sample()
+        if reason := pressed(values):
+            self.calm_since = None
+            # running jobs above the limit: the last step did not take effect yet
+            if self.limit > self.min_jobs and self.running <= self.limit:
+                self._set(self.limit - 1, reason)
+        elif not calm(values):
+            self.calm_since = None
+        elif self.calm_since is None:
+            self.calm_since = now
+        elif (now - self.calm_since >= RAISE_AFTER and self.limit < self.max_jobs
+              and self.running >= self.limit):
+            self._set(self.limit + 1, 'calm')
+            self.calm_since = now
+
+    def _set(self, limit, reason):
+        print(f'GOVERNOR {self.limit} -> {limit} jobs: {reason}', flush=True)
+        self.limit = limit
+        self.cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """ wait until fewer jobs than the limit run """
+        with self.cond:
+            self.update()
+            while self.running >= self.limit:
+                self.cond.wait(INTERVAL)
+                self.update()
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.running -= 1
+                self.cond.notify_all()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+""" startup import budget of the entry points
+
+Runs each entry point with --help under python -X importtime and fails
+if a module meant to load lazily is imported at startup, or if the
+imports take longer than the budget. Run after changing imports.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ENTRY_POINTS = ('cpmyvideos.py', 'youtube.py', 'benchmark.py', 'pktindex.py')
+# imported only on the paths that need them
+LAZY = ('dateparser', 'magic', 'pymediainfo', 'enc_dnxhr', 'enc_hevc_vaapi')
+BUDGET_MS = 120
+# interpreter startup, .pth files of the environment
+STARTUP = ('site', 'encodings')
+LINE_RE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+
+def imports(script):
+    """ return: {top level module: cumulative microseconds}, all imported modules """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    res = subprocess.run([sys.executable, '-X', 'importtime', path, '--help'],
+                         capture_output=True, text=True, check=False)
+    top = {}
+    names = set()
+    for line in res.stderr.splitlines():
+        if match := LINE_RE.match(line):
+            names.add(match[4])
+            if not match[3] and match[4] not in STARTUP:
+                top[match[4]] = int(match[2])
+    return top, names
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup import budget of the entry points')
+    parser.add_argument('--budget', type=float, default=BUDGET_MS,
+                        help='Import time of each entry point, ms (%(default)s)')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='Runs per entry point, the fastest counts (%(default)s)')
+    parser.add_argument('--top', type=int, default=5, help='Slowest imports shown')
+    args = parser.parse_args()
+
+    failed = False
+    for script in ENTRY_POINTS:
+        runs = [imports(script) for _ in range(args.runs)]
+        top, names = min(runs, key=lambda run: sum(run[0].values()))
+        total = sum(top.values()) / 1000
+        eager = sorted({name.split('.')[0] for name in names} & set(LAZY))
+        status = 'OK'
+        if eager or total > args.budget:
+            status = 'FAIL'
+            failed = True
+        slowest = sorted(top.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        print(f"{status} {script} {total:.1f} ms: " +
+              ', '.join(f'{name} {usec / 1000:.1f}' for name, usec in slowest))
+        if eager:
+            print(f'  imported at startup: {" ".join(eager)}')
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+""" output of a job in constant memory
+
+Command output is split at \\r and \\n (runner), lines ended by \\r are
+progress (ffmpeg, x265 stats) replacing the one before. All lines go to
+an optional log file through a large write buffer, the last TAIL lines
+stay in a ring buffer. Unbuffered the lines are printed as they come,
+buffered they are printed whole when the job is done (getvalue()); in
+both cases progress lines reach the console at most every INTERVAL.
+"""
+
+import collections
+import time
+
+# lines kept for getvalue()
+TAIL = 200
+# seconds between progress lines on the console
+INTERVAL = 5.0
+# longer lines are cut, so a line without an end stays bounded
+MAX_LINE = 16384
+LOG_BUFFER = 2**16
+
+class JobLog:
+    """ text stream for print(file=log)
+    out: stream, None: sys.stdout at the time of the print
+    path: log file of all lines, appended, opened at the first line
+    buffered: lines are kept for getvalue() only, progress lines are printed
+    with name, not at all without """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, out=None, path=None, buffered=False, name=None):
+        self.out = out
+        self.buffered = buffered
+        self.name = name
+        self.file = None
+        self.path = path
+        self.lines = collections.deque(maxlen=TAIL)
+        self.dropped = 0
+        # the last kept line is progress, the next one replaces it
+        self.replace = False
+        self.partial = ''
+        # monotonic time of the last progress line printed
+        self.shown = None
+
+    def write(self, text):
+        *lines, self.partial = (self.partial + text).split('\n')
+        for line in lines:
+            self.line(line)
+        if len(self.partial) > MAX_LINE:
+            self.line(self.partial)
+            self.partial = ''
+        return len(text)
+
+    def flush(self):
+        if self.file:
+            self.file.flush()
+
+    def _log(self, line):
+        if self.path and not self.file:
+            # pylint: disable=consider-using-with
+            self.file = open(self.path, 'a', encoding='utf-8', buffering=LOG_BUFFER)
+        if self.file:
+            self.file.write(line + '\n')
+
+    def line(self, line):
+        """ a line of output """
+        line = line[:MAX_LINE]
+        self._log(line)
+        self._keep(line)
+        self.replace = False
+        if not self.buffered:
+            print(line, file=self.out)
+
+    def progress(self, line):
+        """ a line replacing the previous progress line """
+        line = line[:MAX_LINE]
+        self._log(line)
+        # the last progress line stays in the tail: the final stats of the job
+        if self.replace:
+            self.lines[-1] = line
+        else:
+            self._keep(line)
+            self.replace = True
+        now = time.monotonic()
+        if self.buffered and not self.name:
+            return
+        if self.shown is None or now - self.shown >= INTERVAL:
+            self.shown = now
+            print(f'{self.name}: {line}' if self.name else line, file=self.out, flush=True)
+
+    def _keep(self, line):
+        if len(self.lines) == TAIL:
+            self.dropped += 1
+        self.lines.append(line)
+
+    def getvalue(self):
+        """ return: the kept lines """
+        head = ''
+        if self.dropped:
+            head = f"... {self.dropped} lines{f', see {self.path}' if self.path else ''}\n"
+        return head + ''.join(line + '\n' for line in self.lines)
+
+    def close(self):
+        if self.partial:
+            self.line(self.partial)
+            self.partial = ''
+        if self.file:
+            self.file.close()
+            self.file = None
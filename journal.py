@@ -0,0 +1,72 @@
+""" batch journal: JSON lines with the state of each file, for --resume
+
+{"batch": argv, "cwd": ..., "params": {...}, "time": ...} starts a batch,
+{"file": abs path, "state": ..., "time": ..., ...} per state change,
+the last record of a file wins. Records are fsynced, a torn last line
+after a crash is ignored.
+"""
+
+from dataclasses import dataclass, field
+import json
+import os
+import threading
+import time
+
+STATES = ('queued', 'running', 'done', 'failed', 'skipped')
+# not restarted by --resume
+FINISHED = ('done', 'skipped')
+
+@dataclass
+class Batch:
+    """ last batch of a journal, files: abs path -> last record """
+    argv: list
+    cwd: str
+    files: dict = field(default_factory=dict)
+
+    def unfinished(self):
+        return [path for path, rec in self.files.items() if rec['state'] not in FINISHED]
+
+    def finished(self):
+        return {path for path, rec in self.files.items() if rec['state'] in FINISHED}
+
+class Journal:
+    """ thread safe appender, argv: start a new batch, None: continue the last """
+
+    def __init__(self, path, argv=None, params=None):
+        self.lock = threading.Lock()
+        # pylint: disable=consider-using-with
+        self.file = open(path, 'a', encoding='utf-8')
+        if argv is None:
+            self._append({'resume': True, 'time': time.time()})
+        else:
+            self._append({'batch': argv, 'cwd': os.getcwd(), 'params': params or {},
+                          'time': time.time()})
+
+    def write(self, src, state, **data):
+        self._append({'file': os.path.abspath(src), 'state': state, 'time': time.time(),
+                      **data})
+
+    def close(self):
+        self.file.close()
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(',', ':'))
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+def load(path):
+    """ return: last Batch, None if no batch was started """
+    batch = None
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if 'batch' in rec:
+                batch = Batch(rec['batch'], rec['cwd'])
+            elif batch is not None and 'file' in rec:
+                batch.files[rec['file']] = rec
+    return batch
@@ -1,9 +1,9 @@
 """ helpers lib """
 
-import subprocess
-import threading
+import os
 from dataclasses import dataclass
 from typing import Optional
+import runner
 
 ENCODERS = ('x265', 'amf', 'vaapi', 'nv', 'nvenc', 'vceenc')
 
@@ -88,49 +88,41 @@ def format_time(seconds):
     remaining_seconds = seconds % 60
     return f"{minutes:02d}:{remaining_seconds:06.3f}"
 
-def run_cmd(cmd1, cmd2=None, dry=False):
+def cache_path(name):
+    """ path of a file in the user cache dir, the dir is created """
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    path = os.path.join(cache, 'video_utils')
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, name)
+
+def part_name(path):
+    """ hidden temporary name next to path, same extension for the muxer """
+    head, tail = os.path.split(path)
+    base, ext = os.path.splitext(tail)
+    return os.path.join(head, f'.{base}.part{ext}')
+
+def publish(part, path):
+    """ flush part to disk and rename it to path atomically """
+    fd = os.open(part, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(part, path)
+    fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def run_cmd(cmd1, cmd2=None, dry=False, out=None, **kwargs):
+    """ sync wrapper for runner.run(): cmd1 or cmd1 | cmd2
+    out: text stream for command output, sys.stdout if None
+    kwargs: stats, timeout, see runner.run() """
     if cmd2:
-        print(f"COMMAND: {' '.join(cmd1)} | {' '.join(cmd2)}")
+        print(f"COMMAND: {' '.join(cmd1)} | {' '.join(cmd2)}", file=out)
     else:
-        print(f"COMMAND: {' '.join(cmd1)}")
+        print(f"COMMAND: {' '.join(cmd1)}", file=out)
     if dry:
         return 0
-
-    def reader_thread(pipe, process):
-        for line in iter(pipe.readline, b''):
-            if line:
-                print(f'{line.decode().strip()}')
-            if process.poll() is not None:
-                break
-
-    with subprocess.Popen(cmd1, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc1:
-        if cmd2:
-            with subprocess.Popen(cmd2, stdin=proc1.stdout, stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE) as proc2:
-                proc1.stdout.close()  # Allow proc1 to receive a SIGPIPE if proc2 exits.
-
-                stdout_thread = threading.Thread(target=reader_thread, args=(proc2.stdout, proc2))
-                stderr_thread = threading.Thread(target=reader_thread, args=(proc2.stderr, proc2))
-
-                stdout_thread.start()
-                stderr_thread.start()
-
-                proc2.wait()
-                return_code = proc2.returncode
-
-                stdout_thread.join()
-                stderr_thread.join()
-        else:
-            stdout_thread = threading.Thread(target=reader_thread, args=(proc1.stdout, proc1))
-            stderr_thread = threading.Thread(target=reader_thread, args=(proc1.stderr, proc1))
-
-            stdout_thread.start()
-            stderr_thread.start()
-
-            proc1.wait()
-            return_code = proc1.returncode
-
-            stdout_thread.join()
-            stderr_thread.join()
-
-    return return_code
+    return runner.run_sync(runner.run(cmd1, cmd2, out=out, **kwargs))
@@ -0,0 +1,63 @@
+""" per job metrics: phase timers, child resource usage, JSONL export """
+
+from contextlib import contextmanager
+from timeit import default_timer as timer
+import json
+import threading
+
+class Metrics:
+    """ phases: name -> seconds, stats: filled by lib.run_cmd """
+
+    def __init__(self):
+        self.phases = {}
+        self.stats = {}
+        self.data = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = timer()
+        try:
+            yield
+        finally:
+            self.add(name, timer() - start)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def record(self, media_duration=None):
+        """ return: dict for one JSON line """
+        rec = dict(self.data)
+        rec['phases'] = {name: round(sec, 6) for name, sec in self.phases.items()}
+        for key in ('utime', 'stime', 'maxrss'):
+            if key in self.stats:
+                rec[key] = round(self.stats[key], 6)
+        if 'pipe' in self.stats:
+            rec['pipe'] = self.stats['pipe']
+        progress = self.stats.get('progress', {})
+        if progress.get('fps'):
+            rec['fps'] = float(progress['fps'])
+        if progress.get('frame'):
+            rec['frames'] = int(progress['frame'])
+        if progress.get('out_time_us', 'N/A') != 'N/A':
+            media_duration = int(progress['out_time_us']) / 1e6
+        work = self.phases.get('encode') or self.phases.get('copy')
+        if media_duration and work:
+            rec['duration'] = round(media_duration, 3)
+            rec['realtime_factor'] = round(media_duration / work, 3)
+        return rec
+
+class MetricsWriter:
+    """ thread safe JSONL appender """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        # pylint: disable=consider-using-with
+        self.file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':'))
+        with self.lock:
+            self.file.write(line + '\n')
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,108 @@
+""" one decode for several outputs: the master, editing proxies and poster
+thumbnails are branches of a split filter graph in one ffmpeg run, each
+with the filters and params of its own encoder """
+
+import copy
+import os
+import lib
+from encode import FFMPEG_IN
+
+PROXY_FORMATS = ('hevc', 'dnxhr', 'prores', 'cineform')
+# proxies: HEVC with x265, 8 bit, keyframe every second for scrubbing
+PROXY_CRF = 28
+PROXY_PRESET = 'veryfast'
+PROXY_GOP = 1.0
+THUMB_HEIGHT = 360
+THUMB_QUALITY = 3
+
+def parse_proxy(text):
+    """ 'hevc:540', 'prores:720:proxy' -> ('prores', 720, 'proxy' or None) """
+    fmt, _, rest = text.partition(':')
+    height, _, profile = rest.partition(':')
+    if fmt not in PROXY_FORMATS:
+        raise ValueError(f"format '{fmt}' not one of {PROXY_FORMATS}")
+    try:
+        height = int(height)
+    except ValueError:
+        raise ValueError(f"bad height '{height}'") from None
+    if height < 2 or height % 2:
+        raise ValueError(f'height {height} not even')
+    return fmt, height, profile or None
+
+def proxy_opts(opts, spec):
+    """ opts of the master with those of a proxy spec, see encode.Command """
+    fmt, height, profile = spec
+    proxy = copy.copy(opts)
+    proxy.fmt, proxy.enc, proxy.res, proxy.profile = fmt, 'x265', height, profile
+    proxy.all_i, proxy.params, proxy.tune = False, None, None
+    hevc = fmt == 'hevc'
+    proxy.crf = PROXY_CRF if hevc else None
+    proxy.bits = 8 if hevc else None
+    proxy.preset = PROXY_PRESET if hevc else None
+    proxy.gop = PROXY_GOP
+    return proxy
+
+class MultiOutput:
+    """ dst: master path, the other outputs are named after it
+    proxies: parse_proxy() specs, thumbs: count of thumbnails """
+
+    def __init__(self, dst, proxies, thumbs=0):
+        base = os.path.splitext(dst)[0]
+        self.proxies = [f'{base}_proxy-{fmt}{height}.MOV' for fmt, height, _ in proxies]
+        # image2 pattern
+        self.thumb_pattern = base.replace('%', '%%') + '_thumb%02d.jpg'
+        self.thumbs = thumbs
+
+    def files(self):
+        """ return: paths of the other outputs """
+        return self.proxies + [self.thumb_pattern % idx for idx in range(1, self.thumbs + 1)]
+
+    def build(self, src, dst, commands, progress=False):
+        """ dst: master part, commands: encode.Command of the master and the proxies """
+        graph = [f'[0:v]split={len(commands) + bool(self.thumbs)}' +
+                 ''.join(f'[v{idx}]' for idx in range(len(commands) + bool(self.thumbs)))]
+        for idx, command in enumerate(commands):
+            graph.append(f'[v{idx}]{lib.join_filters(command.filters()) or "null"}[out{idx}]')
+        if self.thumbs:
+            graph.append(f'[v{len(commands)}]{self.thumb_filters(commands[0])}[thumbs]')
+        cmd = FFMPEG_IN + ['-i', src, '-filter_complex', ';'.join(graph)]
+        if progress:
+            cmd.extend(['-progress', 'pipe:1'])
+        dsts = [dst] + [lib.part_name(proxy) for proxy in self.proxies]
+        for idx, (command, out) in enumerate(zip(commands, dsts)):
+            cmd.extend(['-map', f'[out{idx}]'])
+            if command.audio_params() is not None:
+                cmd.extend(['-map', '0:a'])
+            for key, val in command.output_params().items():
+                cmd.extend([f'-{key}', val if isinstance(val, str) else str(val)])
+            cmd.append(out)
+        if self.thumbs:
+            cmd += ['-map', '[thumbs]', '-fps_mode', 'passthrough', '-frames:v', str(self.thumbs),
+                    '-q:v', str(THUMB_QUALITY), '-f', 'image2', lib.part_name(self.thumb_pattern)]
+        return cmd
+
+    def thumb_filters(self, command):
+        """ one frame in the middle of each of thumbs equal spans """
+        duration = command.info.duration or 1
+        if command.opts.duration:
+            duration = min(duration, command.opts.duration)
+        span = duration / self.thumbs
+        return lib.join_filters([
+            {'select': f"'gte(t,{span / 2:.6f})*"
+                       f"(isnan(prev_selected_t)+gte(t-prev_selected_t,{span:.6f}))'"},
+            {'scale': f'w=-2:h={min(THUMB_HEIGHT, command.info.height)}:{lib.DSCALE_FLAGS}'},
+        ])
+
+    def publish(self):
+        """ rename the complete parts, return: paths """
+        done = []
+        for path in self.files():
+            if os.path.exists(lib.part_name(path)):
+                lib.publish(lib.part_name(path), path)
+                done.append(path)
+        return done
+
+    def remove_parts(self):
+        for path in self.files():
+            if os.path.exists(lib.part_name(path)):
+                os.remove(lib.part_name(path))
@@ -1,8 +1,8 @@
 """ OO wrapper for pymediainfo """
 
-from dataclasses import dataclass
+from dataclasses import InitVar, dataclass, fields
+import importlib
 from typing import Optional
-from pymediainfo import MediaInfo
 
 @dataclass
 class MyMediaInfo:
@@ -20,6 +20,7 @@ class MyMediaInfo:
     width: Optional[int] = None
     height: Optional[int] = None
     frame_rate: Optional[float] = None
+    duration: Optional[float] = None # seconds
     color_primaries: Optional[str] = None
     color_range: Optional[str] = None
     matrix_coefficients: Optional[str] = None
@@ -29,11 +30,19 @@ class MyMediaInfo:
     audio_format: Optional[str] = None
     audio_channels: Optional[int] = None
     audio_sampling_rate: Optional[str] = None
+    codec_id_info: Optional[str] = None
+    scan_type: Optional[str] = None
+    # False: fields are given by caller (catalog), do not parse the file
+    probe: InitVar[bool] = True
 
-    def __post_init__(self):
-        self.media_info = MediaInfo.parse(self.file_name)
+    def __post_init__(self, probe):
+        self.media_info = None
         self.video_track = None
         self.audio_track = None
+        if not probe:
+            return
+        # not imported for catalog entries
+        self.media_info = importlib.import_module('pymediainfo').MediaInfo.parse(self.file_name)
 
         for track in self.media_info.tracks:
             if track.track_type == 'Video' and self.video_track is None:
@@ -61,11 +70,15 @@ class MyMediaInfo:
             self.width = self.video_track.width
             self.height = self.video_track.height
             self.frame_rate = self.video_track.frame_rate
+            if self.video_track.duration:
+                self.duration = float(self.video_track.duration) / 1000.0
             self.color_primaries = self.video_track.color_primaries
             self.matrix_coefficients = self.video_track.matrix_coefficients
             self.transfer_characteristics = self.video_track.transfer_characteristics
             self.color_range = self.video_track.color_range
-            self.is_interlaced = self.video_track.scan_type != 'Progressive'
+            self.codec_id_info = self.video_track.codec_id_info
+            self.scan_type = self.video_track.scan_type
+            self.is_interlaced = self.scan_type != 'Progressive'
             self.is_hq = self.format in ['VC-3', 'FFV1', 'ProRes', 'HFYU']
             self.has_audio = self.audio_track is not None
 
@@ -75,37 +88,46 @@ class MyMediaInfo:
             self.audio_sampling_rate = self.audio_track.sampling_rate
 
 
+    @classmethod
+    def from_dict(cls, file_name, data):
+        return cls(file_name, **data, probe=False)
+
+    def to_dict(self):
+        """ all fields except file_name """
+        return {f.name: getattr(self, f.name) for f in fields(self)
+                if f.name != 'file_name'}
+
     def video_data(self):
         return self.video_track.to_data()
 
     def audio_data(self):
         return self.audio_track.to_data()
 
-    def print(self):
-        print(f'Video: {self.width}x{self.height} @ {self.frame_rate}')
-        print(f'Bit rate: {self.bit_rate}')
+    def print(self, file=None):
+        print(f'Video: {self.width}x{self.height} @ {self.frame_rate}', file=file)
+        print(f'Bit rate: {self.bit_rate}', file=file)
         if self.bit_depth:
-            print(f'Bit depth: {self.bit_depth}')
+            print(f'Bit depth: {self.bit_depth}', file=file)
         fmt = self.format
-        if self.video_track.codec_id_info:
-            fmt = f'{fmt} ({self.video_track.codec_id_info})'
-        print(f'Format: {fmt}')
+        if self.codec_id_info:
+            fmt = f'{fmt} ({self.codec_id_info})'
+        print(f'Format: {fmt}', file=file)
         if self.format_profile:
-            print(f'Format profile: {self.format_profile}')
+            print(f'Format profile: {self.format_profile}', file=file)
         if self.format_settings:
-            print(f'Format settings: {self.format_settings}')
+            print(f'Format settings: {self.format_settings}', file=file)
         if self.color_format:
-            print(f'Color format: {self.color_format}')
+            print(f'Color format: {self.color_format}', file=file)
         if self.color_primaries:
-            print(f'Color primaries: {self.color_primaries}')
+            print(f'Color primaries: {self.color_primaries}', file=file)
         if self.matrix_coefficients:
-            print(f'Matrix coefficients: {self.matrix_coefficients}')
+            print(f'Matrix coefficients: {self.matrix_coefficients}', file=file)
         if self.transfer_characteristics:
-            print(f'Transfer characteristics: {self.transfer_characteristics}')
+            print(f'Transfer characteristics: {self.transfer_characteristics}', file=file)
         if self.color_range:
-            print(f'Color range: {self.color_range}')
-        print(f'Scan: {self.video_track.scan_type}')
-        if self.audio_track:
-            print(f'Audio format: {self.audio_format}')
-            print(f'Audio sampling rate: {self.audio_sampling_rate}')
-            print(f'Audio channels: {self.audio_channels}')
+            print(f'Color range: {self.color_range}', file=file)
+        print(f'Scan: {self.scan_type}', file=file)
+        if self.has_audio:
+            print(f'Audio format: {self.audio_format}', file=file)
+            print(f'Audio sampling rate: {self.audio_sampling_rate}', file=file)
+            print(f'Audio channels: {self.audio_channels}', file=file)
@@ -0,0 +1,125 @@
+""" decode | encode pipelines
+
+ffmpeg decodes, filters and scales to yuv4mpegpipe, a standalone encoder
+reads it from the pipe, audio and metadata are muxed from the source
+afterwards. Decoder and encoder get their own thread counts, and the
+encoder CLI options the ffmpeg wrapper does not expose.
+"""
+
+from functools import cache
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import lib
+from encode import FFMPEG, FFMPEG_IN
+from pktindex import FFPROBE
+
+ENCODERS = ('x265', 'ffmpeg')
+X265 = ['x265']
+
+@cache
+def has_dts2pts():
+    """ ffmpeg 7.1+ derives the pts of raw HEVC from the POC """
+    try:
+        text = subprocess.run(FFMPEG + ['-h', 'bsf=dts2pts'], capture_output=True, text=True,
+                              check=False).stdout
+    except OSError:
+        return False
+    return re.search(r'Supported codecs:.*\bhevc\b', text) is not None
+
+def x265_muxable(enc_args):
+    """ raw HEVC gets no pts from ffmpeg, fine without B-frames """
+    return has_dts2pts() or re.search(r'--bframes[= ]0\b', enc_args or '') is not None
+
+def frame_rate(src, default):
+    """ return: exact rate of the first video stream ('30000/1001'), default if
+    ffprobe gives none; the rounded mediainfo rate drifts against the audio """
+    cmd = FFPROBE + ['-show_entries', 'stream=r_frame_rate', '-of', 'csv=p=0', src]
+    try:
+        rate = subprocess.run(cmd, capture_output=True, check=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return default
+    return rate if re.fullmatch(r'[1-9]\d*/[1-9]\d*', rate) else default
+
+class PipedEncode:
+    """ command: encode.Command, out: text stream for output """
+
+    def __init__(self, command, src, dst, out=None):
+        self.command = command
+        self.src = src
+        self.dst = dst
+        self.out = out
+
+    def run(self, encoder, threads=(None, None), dry=False, **kwargs):
+        """ encoder: one of ENCODERS, threads: decoder, encoder threads
+        kwargs: stats, timeout
+        return: exit code """
+        workdir = tempfile.mkdtemp(prefix='.pipe-', dir=os.path.dirname(self.dst) or '.')
+        try:
+            if encoder == 'x265':
+                video = os.path.join(workdir, 'video.hevc')
+                cmd2 = self.x265(video, threads[1])
+                rate = frame_rate(self.src, str(self.command.info.frame_rate))
+                mux = self.command.mux(['-framerate', rate, '-i', video], self.src, self.dst)
+                if has_dts2pts():
+                    mux[-1:-1] = ['-bsf:v', 'dts2pts']
+            else:
+                video = os.path.join(workdir, 'video.nut')
+                cmd2 = self.ffmpeg(video, threads[1])
+                mux = self.command.mux(['-i', video], self.src, self.dst)
+            rcode = lib.run_cmd(self.decoder(threads[0]), cmd2, dry=dry, out=self.out, **kwargs)
+            if rcode != 0:
+                return rcode
+            return lib.run_cmd(mux, dry=dry, out=self.out, stats=kwargs.get('stats'))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def decoder(self, threads=None):
+        cmd = FFMPEG_IN.copy()
+        if threads:
+            cmd += ['-threads', str(threads), '-filter_threads', str(threads)]
+        cmd += ['-i', self.src, '-map', '0:v:0', '-an', '-sn', '-dn']
+        filter_v = self.command.filters()
+        if filter_v:
+            cmd += ['-filter:v', lib.join_filters(filter_v)]
+        if self.command.opts.duration:
+            cmd += ['-t', str(self.command.opts.duration)]
+        # -strict: 10 bit y4m
+        return cmd + ['-f', 'yuv4mpegpipe', '-strict', '-1', '-']
+
+    def ffmpeg(self, dst, threads=None):
+        cmd = FFMPEG + ['-f', 'yuv4mpegpipe', '-i', '-']
+        if threads:
+            cmd += ['-threads', str(threads)]
+        for key, val in self.command.video_params().items():
+            cmd.extend([f'-{key}', val if isinstance(val, str) else str(val)])
+        return cmd + self.extra() + [dst]
+
+    def x265(self, dst, threads=None):
+        """ x265 CLI from the params of enc_hevc_x265 """
+        params = self.command.video_params()
+        cmd = X265 + ['--input', '-', '--y4m', '--output-depth', str(self.command.video().bits)]
+        for key, opt in (('preset', '--preset'), ('crf', '--crf'), ('profile:v', '--profile'),
+                         ('tune', '--tune')):
+            if key in params:
+                cmd += [opt, str(params[key])]
+        if 'g:v' in params:
+            cmd += ['--keyint', str(max(params['g:v'], 1))]
+        for param in filter(None, params.get('x265-params', '').split(':')):
+            name, _, value = param.partition('=')
+            if value in ('', '1'):
+                cmd.append(f'--{name}')
+            elif value == '0':
+                cmd.append(f'--no-{name}')
+            else:
+                cmd += [f'--{name}', value]
+        if threads:
+            cmd += ['--pools', str(threads)]
+        return cmd + self.extra() + ['--output', dst]
+
+    def extra(self):
+        """ --enc-args of the encoder """
+        return shlex.split(self.command.opts.enc_args or '')
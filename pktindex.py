@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+""" packet index of a source: pts, size and keyframe flag of each video
+packet from one demux pass, no decoding
+
+Kept as a sidecar in the user cache dir, typed arrays behind a small
+header, mapped read-only when loaded; a changed size or mtime of the
+source rebuilds it. Layout: header, pts float64 seconds, sizes uint32,
+keyframe packet numbers uint32, packets in presentation order.
+"""
+
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import subprocess
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+import lib
+
+FFPROBE = ['ffprobe', '-v', 'error', '-ignore_editlist', '1', '-select_streams', 'v:0']
+MAGIC = b'PKTIDX1\0'
+# magic, source size, source mtime_ns, packets, keyframes
+HEADER = struct.Struct('<8sQqII')
+
+class PacketIndex:
+    """ pts: seconds, sizes: bytes, keys: numbers of keyframe packets,
+    sequences in presentation order """
+
+    def __init__(self, pts, sizes, keys):
+        self.pts = pts
+        self.sizes = sizes
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.pts)
+
+    def key_times(self):
+        return [self.pts[key] for key in self.keys]
+
+    def key_before(self, time):
+        """ return: pts of the last keyframe at or before time, the first if none """
+        times = self.key_times()
+        return times[max(bisect_right(times, time) - 1, 0)] if times else None
+
+    def nearest_key(self, time):
+        """ return: pts of the keyframe nearest to time """
+        times = self.key_times()
+        if not times:
+            return None
+        pos = bisect_left(times, time)
+        return min(times[max(pos - 1, 0):pos + 1], key=lambda key: abs(key - time))
+
+    def count(self, start, end):
+        """ return: packets with start <= pts < end """
+        return bisect_left(self.pts, end) - bisect_left(self.pts, start)
+
+    def bitrate(self, step=1.0):
+        """ return: bits per second of each step long span from the first pts """
+        if not self.pts:
+            return []
+        first = self.pts[0]
+        rates = [0.0] * (int((self.pts[-1] - first) / step) + 1)
+        for time, size in zip(self.pts, self.sizes):
+            rates[int((time - first) / step)] += size * 8 / step
+        return rates
+
+def index(src, cache_dir=None):
+    """ return: PacketIndex of src, from the sidecar if it is current """
+    stat = os.stat(src)
+    path = sidecar(src, cache_dir)
+    try:
+        with open(path, 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        data = None
+    if data is not None:
+        if len(data) >= HEADER.size:
+            magic, size, mtime_ns, count, keys = HEADER.unpack_from(data)
+            if (magic, size, mtime_ns) == (MAGIC, stat.st_size, stat.st_mtime_ns):
+                return _view(data, count, keys)
+        data.close()
+    pkt_index = scan(src)
+    write(path, stat, pkt_index)
+    return pkt_index
+
+def sidecar(src, cache_dir=None):
+    cache_dir = cache_dir or lib.cache_path('pktindex')
+    os.makedirs(cache_dir, exist_ok=True)
+    name = hashlib.blake2b(os.path.abspath(src).encode(), digest_size=16).hexdigest()
+    return os.path.join(cache_dir, f'{name}.idx')
+
+def scan(src):
+    """ one ffprobe demux pass, return: PacketIndex of arrays """
+    cmd = FFPROBE + ['-show_entries', 'packet=pts_time,size,flags', '-of', 'csv=p=0', src]
+    res = subprocess.run(cmd, capture_output=True, check=True, text=True)
+    packets = []
+    for line in res.stdout.splitlines():
+        time, size, flags = (line.split(',') + ['', ''])[:3]
+        if not time or time == 'N/A':
+            continue
+        packets.append((float(time), int(size), 'K' in flags))
+    # decode to presentation order
+    packets.sort()
+    return PacketIndex(array('d', (pkt[0] for pkt in packets)),
+                       array('I', (pkt[1] for pkt in packets)),
+                       array('I', (num for num, pkt in enumerate(packets) if pkt[2])))
+
+def write(path, stat, pkt_index):
+    temp = f'{path}.{os.getpid()}'
+    with open(temp, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, len(pkt_index.pts),
+                               len(pkt_index.keys)))
+        for values in (pkt_index.pts, pkt_index.sizes, pkt_index.keys):
+            values.tofile(file)
+    os.replace(temp, path)
+
+def _view(data, count, keys):
+    """ PacketIndex of memoryviews into the mapped sidecar """
+    view = memoryview(data)
+    pos = HEADER.size
+    pts = view[pos:pos + 8 * count].cast('d')
+    pos += 8 * count
+    sizes = view[pos:pos + 4 * count].cast('I')
+    pos += 4 * count
+    return PacketIndex(pts, sizes, view[pos:pos + 4 * keys].cast('I'))
+
+def __main__():
+    parser = argparse.ArgumentParser(description='Packet and keyframe index of videos')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--step', type=float, default=1.0,
+                        help='Bitrate span, seconds (%(default)s)')
+    parser.add_argument('--curve', action='store_true', help='Print the bitrate of each span')
+    args = parser.parse_args()
+    for src in args.files:
+        try:
+            pkt_index = index(src)
+        except (OSError, subprocess.CalledProcessError) as ex:
+            sys.exit(f'Cannot index {src}: {ex}')
+        rates = pkt_index.bitrate(args.step)
+        keys = pkt_index.key_times()
+        gop = (keys[-1] - keys[0]) / (len(keys) - 1) if len(keys) > 1 else 0
+        print(f'{src}: {len(pkt_index)} packets, {len(keys)} keyframes, '
+              f'GOP {gop:.2f}s, bitrate avg {sum(rates) / max(len(rates), 1) / 1e6:.2f} '
+              f'max {max(rates, default=0) / 1e6:.2f} Mbps')
+        if args.curve:
+            for num, rate in enumerate(rates):
+                print(f'{num * args.step:10.1f} {rate / 1e6:8.3f}')
+
+if __name__ == '__main__':
+    __main__()
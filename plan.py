@@ -0,0 +1,73 @@
+""" batch plan: every file is probed first and gets a predicted cost,
+jobs run longest first so a big file does not start last
+
+cost: output pixels x frames x encoder speed factor, seconds by RATE;
+size: bits per output pixel, video only. Rough, calibrate with benchmark.py.
+"""
+
+import heapq
+import json
+import os
+import time
+import lib
+
+# relative time per output pixel, x265 medium = 1
+X265_PRESETS = {'ultrafast': .25, 'superfast': .3, 'veryfast': .45, 'faster': .6, 'fast': .8,
+                'medium': 1, 'slow': 2, 'slower': 5, 'veryslow': 12, 'placebo': 40}
+SPEED = {'nv': .05, 'nvenc': .05, 'vaapi': .08, 'amf': .05, 'vceenc': .05,
+         'dnxhr': .04, 'prores': .06, 'cineform': .05}
+# x265 medium output pixels per second and cpu
+RATE = 4e6
+# --copy bytes per second
+COPY_RATE = 2e8
+# bits per output pixel, HEVC at lib.CRF['hevc'] and half per 6 crf more
+BPP = {'hevc': .15, 'dnxhr': 3.4, 'prores': 3.4, 'cineform': 3.0}
+
+def frames(info, duration=None):
+    seconds = info.duration or 0
+    if duration:
+        seconds = min(seconds, duration)
+    return int(seconds * float(info.frame_rate or 25))
+
+def estimate(command, enc, workers=1):
+    """ command: encode.Command, workers: jobs sharing the cpus
+    return: {frames, pixels, factor, seconds, size} """
+    opts, info = command.opts, command.info
+    height = opts.res if command.need_scale() else info.height
+    pixels = info.width * height // info.height * height
+    count = frames(info, opts.duration)
+    if opts.fmt != 'hevc':
+        factor, bpp = SPEED[opts.fmt], BPP[opts.fmt]
+    else:
+        factor = SPEED.get(enc) or X265_PRESETS.get(command.encoder.get_params().get('preset'), 1)
+        bpp = BPP['hevc'] * 2 ** ((lib.CRF['hevc'] - opts.crf) / 6)
+    return {'frames': count, 'pixels': pixels, 'factor': factor,
+            'seconds': round(pixels * count * factor * workers / RATE / (os.cpu_count() or 1), 1),
+            'size': int(pixels * count * bpp / 8)}
+
+def estimate_copy(size):
+    return {'seconds': round(size / COPY_RATE, 1), 'size': size}
+
+def makespan(seconds, workers):
+    """ finish of the last of workers taking the jobs in this order """
+    ends = [0.0] * workers
+    for sec in seconds:
+        heapq.heapreplace(ends, ends[0] + sec)
+    return max(ends)
+
+def write(path, argv, workers, entries):
+    """ entries: [{src, dst, seconds, size, ...}] in run order, path '-': stdout """
+    plan = {'argv': argv, 'cwd': os.getcwd(), 'time': time.time(), 'jobs': workers,
+            'makespan': round(makespan([ent['seconds'] for ent in entries], workers), 1),
+            'size': sum(ent['size'] for ent in entries), 'files': entries}
+    text = json.dumps(plan, indent=1)
+    if path == '-':
+        print(text)
+        return
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(text + '\n')
+
+def load(path):
+    """ return: plan dict, paths relative to its cwd """
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
@@ -0,0 +1,68 @@
+""" encoder pool: sessions per encoder, each file takes the first free
+encoder that accepts it, in the order given
+
+'nvenc:3' three sessions, 'vaapi:2:height<=1080' two, only for files
+matching the condition (see catalog.parse_where). Encoder names are
+opaque here, any name works.
+"""
+
+from contextlib import contextmanager
+import threading
+import catalog
+
+def parse(text):
+    """ 'enc:slots[:where]' -> (enc, slots, predicate or None) """
+    name, _, rest = text.partition(':')
+    slots, _, where = rest.partition(':')
+    try:
+        slots = int(slots or 1)
+    except ValueError:
+        raise ValueError(f"bad session count '{slots}' of '{name}'") from None
+    if slots < 1:
+        raise ValueError(f"need at least 1 session of '{name}'")
+    return name, slots, catalog.parse_where(where) if where else None
+
+class Pool:
+    """ specs: [(encoder, slots, predicate(info) or None)] by preference """
+
+    def __init__(self, specs):
+        self.specs = specs
+        self.cond = threading.Condition()
+        self.free = {name: slots for name, slots, _ in specs}
+
+    @property
+    def size(self):
+        return sum(slots for _, slots, _ in self.specs)
+
+    def candidates(self, info):
+        """ return: encoders accepting info, by preference """
+        return [name for name, _, accept in self.specs if accept is None or accept(info)]
+
+    def acquire(self, info):
+        """ wait for a session of an encoder accepting info
+        return: encoder name, None if no encoder accepts info """
+        names = self.candidates(info)
+        if not names:
+            return None
+        with self.cond:
+            while True:
+                for name in names:
+                    if self.free[name] > 0:
+                        self.free[name] -= 1
+                        return name
+                self.cond.wait()
+
+    def release(self, name):
+        with self.cond:
+            self.free[name] += 1
+            self.cond.notify_all()
+
+    @contextmanager
+    def session(self, info):
+        """ yield: encoder name or None, released on exit """
+        name = self.acquire(info)
+        try:
+            yield name
+        finally:
+            if name is not None:
+                self.release(name)
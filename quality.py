@@ -0,0 +1,68 @@
+""" objective quality of an encode against its source with ffmpeg filters:
+VMAF when ffmpeg has libvmaf, SSIM and PSNR otherwise """
+
+from functools import cache
+import io
+import os
+import re
+import subprocess
+import lib
+from encode import FFMPEG, FFMPEG_IN
+
+# both sides are converted to this before comparing
+COMPARE_FORMAT = 'yuv444p10le'
+SCORE_RE = {
+    'vmaf': re.compile(r'VMAF score: ([\d.]+)'),
+    'ssim': re.compile(r'SSIM .*All:([\d.]+)'),
+    'psnr': re.compile(r'PSNR .*average:([\d.]+|inf)'),
+}
+
+@cache
+def has_vmaf():
+    try:
+        filters = subprocess.run(FFMPEG + ['-filters'], capture_output=True, text=True,
+                                 check=False).stdout
+    except OSError:
+        return False
+    return re.search(r'^\s*\S+\s+libvmaf\s', filters, re.M) is not None
+
+def metrics(vmaf=None):
+    """ names of the metrics measure() returns, vmaf: None for auto """
+    if vmaf is None:
+        vmaf = has_vmaf()
+    return ('vmaf',) if vmaf else ('ssim', 'psnr')
+
+def measure(src, dst, size, vmaf=None, span=None):
+    """ src: reference, dst: encode, size: (width, height) of src
+    span: (start, duration) of dst in src, seconds, None for all
+    return: {metric: score}, None values if ffmpeg failed """
+    names = metrics(vmaf)
+    start, duration = span or (None, None)
+    # the encode with its edit list, the source as the encoders read it
+    cmd = FFMPEG + ['-nostats', '-i', dst]
+    if duration:
+        cmd += ['-t', str(duration)]
+    cmd += FFMPEG_IN[len(FFMPEG):]
+    if start:
+        cmd += ['-ss', f'{start:.6f}']
+    cmd += ['-i', src, '-lavfi', _graph(names, size), '-f', 'null', '-']
+    out = io.StringIO()
+    rcode = lib.run_cmd(cmd, out=out)
+    scores = dict.fromkeys(names)
+    if rcode == 0:
+        for line in out.getvalue().splitlines():
+            for name in names:
+                if match := SCORE_RE[name].search(line):
+                    scores[name] = float(match[1])
+    return scores
+
+def _graph(names, size):
+    prep = f'format={COMPARE_FORMAT}'
+    graph = [f'[0:v]scale={size[0]}:{size[1]}:flags=bicubic,{prep}[dst]',
+             f'[1:v]{prep}[src]']
+    if names == ('vmaf',):
+        graph.append(f'[dst][src]libvmaf=shortest=1:n_threads={os.cpu_count() or 1}')
+    else:
+        graph += ['[dst]split[dst1][dst2]', '[src]split[src1][src2]',
+                  '[dst1][src1]ssim=shortest=1', '[dst2][src2]psnr=shortest=1']
+    return ';'.join(graph)
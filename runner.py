@@ -0,0 +1,319 @@
+""" asyncio process runner: single commands and cmd1 | cmd2 pipelines
+
+Each command runs in its own session/process group so a timeout, a
+cancellation or a signal reaches the encoder and everything it spawned.
+Children are reaped with os.wait4 (woken by a pidfd where available) to
+keep their resource usage; no threads are needed per process. Pipelines
+get enlarged pipes and a splice relay that times how long each side
+waited for the other.
+"""
+
+import asyncio
+import fcntl
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from contextlib import suppress
+import joblog
+
+# seconds between SIGTERM and SIGKILL
+TERM_GRACE = 10.0
+READ_SIZE = 65536
+# pipe buffer of cmd1 | cmd2, over /proc/sys/fs/pipe-max-size needs CAP_SYS_RESOURCE
+PIPE_SIZE = 16 * 2**20
+
+# key=value lines of ffmpeg -progress
+PROGRESS_RE = re.compile(r'^(\w+)=(.*)$')
+# ffmpeg and x265 end their progress lines with a lone \r
+LINE_END_RE = re.compile(rb'(\r\n|\r|\n)')
+
+# process group ids of running commands, from all threads/loops
+GROUPS = set()
+
+def terminate_all(grace=TERM_GRACE):
+    """ SIGTERM all running commands, SIGKILL those still running after grace
+    seconds; blocking, for threads that do not own the event loops """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        for pgid in list(GROUPS):
+            with suppress(ProcessLookupError):
+                os.killpg(pgid, sig)
+        deadline = time.monotonic() + grace
+        while GROUPS and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if not GROUPS:
+            break
+
+def exit_on_sigterm():
+    """ SIGTERM raises SystemExit in the main thread, so cleanup code runs """
+    def handler(signum, _frame):
+        sys.exit(128 + signum)
+    signal.signal(signal.SIGTERM, handler)
+
+def run_sync(coro):
+    """ run a coroutine in a new event loop, SIGINT/SIGTERM cancel it
+    (main thread only), then raise KeyboardInterrupt/SystemExit """
+    received = []
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        sigs = ()
+        if threading.current_thread() is threading.main_thread():
+            sigs = (signal.SIGINT, signal.SIGTERM)
+        # remove_signal_handler() sets SIG_DFL, the handlers of the caller come back
+        saved = {sig: signal.getsignal(sig) for sig in sigs}
+        for sig in sigs:
+            loop.add_signal_handler(sig, lambda s=sig: (received.append(s), task.cancel()))
+        try:
+            return await coro
+        finally:
+            for sig in sigs:
+                loop.remove_signal_handler(sig)
+                signal.signal(sig, saved[sig])
+
+    try:
+        return asyncio.run(main())
+    except asyncio.CancelledError:
+        if signal.SIGINT in received:
+            raise KeyboardInterrupt from None
+        if received:
+            sys.exit(128 + received[0])
+        raise
+
+async def run(cmd1, cmd2=None, out=None, stats=None, timeout=None, **popen):
+    """ run cmd1 or cmd1 | cmd2, print output to out: joblog.JobLog or a
+    stream (sys.stdout if None), progress lines at most every joblog.INTERVAL
+    stats: dict to fill with child utime, stime (s), maxrss (KiB),
+    'progress' key=value lines (ffmpeg -progress pipe:1) from stdout and
+    'pipe' {bytes, size, wait1, wait2}: seconds cmd1 waited for cmd2 to
+    take its output, cmd2 for cmd1 to give input, as seen by the relay
+    timeout: seconds, then the command is terminated
+    popen: more subprocess.Popen arguments (cwd, env)
+    return: exit code, of a pipeline as with pipefail: cmd2's if it failed, else cmd1's,
+    so an encoder finishing the frames of a failed decoder is no success """
+    progress = None
+    if stats is not None:
+        progress = stats.setdefault('progress', {})
+    if not isinstance(out, joblog.JobLog):
+        out = joblog.JobLog(out)
+    procs = []
+    relay = []
+    try:
+        _start(cmd1, cmd2, procs, relay, **popen)
+    except OSError:
+        _close(procs, relay)
+        await _terminate(procs, [asyncio.create_task(_wait(p, stats)) for p in procs])
+        raise
+    if cmd2:
+        pipes = [(procs[0].stderr, None), (procs[1].stdout, progress), (procs[1].stderr, None)]
+    else:
+        pipes = [(procs[0].stdout, progress), (procs[0].stderr, None)]
+
+    readers = [asyncio.create_task(_read(pipe, out, prog)) for pipe, prog in pipes]
+    if relay:
+        readers.append(asyncio.create_task(_relay(*relay, out, stats)))
+    waits = [asyncio.create_task(_wait(proc, stats)) for proc in procs]
+    try:
+        _, pending = await asyncio.wait(waits, timeout=timeout)
+        if pending:
+            print(f'TIMEOUT after {timeout}s', file=out)
+            await _terminate(procs, waits)
+        await asyncio.gather(*readers)
+    except asyncio.CancelledError:
+        await _terminate(procs, waits)
+        for reader in readers:
+            reader.cancel()
+        raise
+    return procs[-1].returncode or procs[0].returncode
+
+async def run_many(cmds, limit=None, fail_fast=False, **kwargs):
+    """ run commands concurrently from one loop, at most limit at once
+    cmds: list of cmd or (cmd1, cmd2), kwargs: passed to run()
+    fail_fast: cancel the rest after the first non-zero exit code
+    return: exit codes in order, None for cancelled commands """
+    sem = asyncio.Semaphore(limit or len(cmds) or 1)
+    codes = [None] * len(cmds)
+
+    async def one(idx, cmd):
+        async with sem:
+            if isinstance(cmd, tuple):
+                codes[idx] = await run(*cmd, **kwargs)
+            else:
+                codes[idx] = await run(cmd, **kwargs)
+        if codes[idx] != 0 and fail_fast:
+            raise ChildProcessError(codes[idx])
+
+    tasks = [asyncio.create_task(one(idx, cmd)) for idx, cmd in enumerate(cmds)]
+    try:
+        await asyncio.gather(*tasks)
+    except ChildProcessError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return codes
+
+def _start(cmd1, cmd2, procs, relay, **popen):
+    """ spawn cmd1 or cmd1 -> relay -> cmd2 into procs, the relay fds into relay """
+    if not cmd2:
+        procs.append(_spawn(cmd1, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen))
+        return
+    fds = _pipe() + _pipe()
+    # the relay passes EOF and EPIPE on
+    relay += [fds[0], fds[3]]
+    try:
+        procs.append(_spawn(cmd1, stdout=fds[1], stderr=subprocess.PIPE, **popen))
+        procs.append(_spawn(cmd2, stdin=fds[2], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, **popen))
+    finally:
+        os.close(fds[1])
+        os.close(fds[2])
+
+def _close(procs, relay):
+    for fd in relay:
+        os.close(fd)
+    for proc in procs:
+        for pipe in (proc.stdout, proc.stderr):
+            if pipe:
+                pipe.close()
+
+def _pipe():
+    """ return: [read fd, write fd], as large as allowed """
+    fds = list(os.pipe())
+    sizes = [PIPE_SIZE]
+    with suppress(OSError, ValueError):
+        with open('/proc/sys/fs/pipe-max-size', encoding='ascii') as file:
+            sizes.append(min(int(file.read()), PIPE_SIZE))
+    for size in sizes:
+        with suppress(OSError):
+            fcntl.fcntl(fds[1], fcntl.F_SETPIPE_SZ, size)
+            break
+    return fds
+
+async def _relay(src, dst, out, stats):
+    """ splice src to dst until EOF or EPIPE, then close both """
+    loop = asyncio.get_running_loop()
+    pipe = {'bytes': 0, 'size': fcntl.fcntl(dst, fcntl.F_GETPIPE_SZ), 'wait1': 0.0,
+            'wait2': 0.0}
+    try:
+        while True:
+            start = time.monotonic()
+            await _ready(src, loop.add_reader, loop.remove_reader)
+            pipe['wait2'] += time.monotonic() - start
+            try:
+                count = os.splice(src, dst, pipe['size'],
+                                  flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+            except BlockingIOError:
+                # dst is full
+                start = time.monotonic()
+                await _ready(dst, loop.add_writer, loop.remove_writer)
+                pipe['wait1'] += time.monotonic() - start
+                continue
+            except BrokenPipeError:
+                break
+            if count == 0:
+                break
+            pipe['bytes'] += count
+    finally:
+        os.close(src)
+        os.close(dst)
+        if stats is not None:
+            stats['pipe'] = {key: round(val, 3) for key, val in pipe.items()}
+    print(f"PIPE {pipe['bytes'] / 2**20:.1f} MiB through {pipe['size'] // 1024} KiB, "
+          f"waited for the next stage {pipe['wait1']:.1f}s, "
+          f"for the previous {pipe['wait2']:.1f}s", file=out)
+
+async def _ready(fd, add, remove):
+    """ wait until fd is readable (add: loop.add_reader) or writable """
+    ready = asyncio.get_running_loop().create_future()
+    add(fd, lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        remove(fd)
+
+def _spawn(cmd, **kwargs):
+    kwargs.setdefault('stdin', subprocess.DEVNULL)
+    # pylint: disable=consider-using-with
+    proc = subprocess.Popen(cmd, start_new_session=True, **kwargs)
+    GROUPS.add(proc.pid)
+    return proc
+
+async def _terminate(procs, waits):
+    if not waits:
+        # nothing was started
+        return
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        for proc in procs:
+            if proc.returncode is None:
+                with suppress(ProcessLookupError):
+                    os.killpg(proc.pid, sig)
+        _, pending = await asyncio.wait(waits, timeout=TERM_GRACE)
+        if not pending:
+            break
+
+async def _wait(proc, stats):
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):
+        pidfd = None
+    if pidfd is None:
+        _, status, rusage = await loop.run_in_executor(None, os.wait4, proc.pid, 0)
+    else:
+        exited = loop.create_future()
+
+        def readable():
+            loop.remove_reader(pidfd)
+            if not exited.done():
+                exited.set_result(None)
+
+        loop.add_reader(pidfd, readable)
+        try:
+            await exited
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+        _, status, rusage = os.wait4(proc.pid, 0)
+    GROUPS.discard(proc.pid)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if stats is not None:
+        stats['utime'] = stats.get('utime', 0.0) + rusage.ru_utime
+        stats['stime'] = stats.get('stime', 0.0) + rusage.ru_stime
+        stats['maxrss'] = max(stats.get('maxrss', 0), rusage.ru_maxrss)
+    return proc.returncode
+
+async def _read(pipe, out, progress):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    try:
+        rest = b''
+        while chunk := await reader.read(READ_SIZE):
+            data = rest + chunk
+            # a \r at the end may be the first half of \r\n
+            cut = len(data) - 1 if data.endswith(b'\r') else len(data)
+            *parts, rest = LINE_END_RE.split(data[:cut])
+            rest += data[cut:]
+            for line, end in zip(parts[::2], parts[1::2]):
+                _line(line, out, progress, end == b'\r')
+            if len(rest) > joblog.MAX_LINE:
+                _line(rest, out, progress, False)
+                rest = b''
+        _line(rest, out, progress, False)
+    finally:
+        transport.close()
+
+def _line(line, out, progress, replaced):
+    """ replaced: line ended by \r, a progress line """
+    line = line.decode(errors='replace').strip()
+    if progress is not None and (match := PROGRESS_RE.match(line)):
+        progress[match[1]] = match[2]
+    elif line and replaced:
+        out.progress(line)
+    elif line:
+        out.line(line)
@@ -0,0 +1,194 @@
+""" watch a source directory for new files: inotify events (Linux, through
+ctypes) or, where it is not available or does not see the writes (network
+filesystems), a scan every poll seconds
+
+A file is given once its size and mtime have not changed for the settle
+time, so half-copied files are not probed; without inotify that is seen
+by the scans, with it each write event starts the wait again. Hidden
+files are left alone: temporary names of uploads (rsync) and of the
+.part outputs, the final name arrives with a rename.
+"""
+
+import ctypes
+import os
+import select
+import struct
+import time
+
+# seconds a file must stay unchanged
+SETTLE = 5.0
+# seconds between scans without inotify
+POLL = 10.0
+
+# inotify(7)
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+        IN_DELETE)
+GONE = IN_MOVED_FROM | IN_DELETE
+# wd, mask, cookie, name length
+EVENT = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+class Inotify:
+    """ inotify instance of watched directories, OSError or AttributeError
+    if the system has none """
+
+    def __init__(self):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        # wd: directory
+        self.dirs = {}
+
+    def watch(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(path), MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self.dirs[wd] = path
+
+    def read(self, timeout=None):
+        """ return: [(mask, path)] of the events within timeout seconds,
+        None if events were lost (queue overflow) """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, size = EVENT.unpack_from(data, pos)
+            name = data[pos + EVENT.size:pos + EVENT.size + size].rstrip(b'\0')
+            pos += EVENT.size + size
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+            elif wd in self.dirs and name:
+                events.append((mask, os.path.join(self.dirs[wd], os.fsdecode(name))))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def _key(stat):
+    return stat.st_size, stat.st_mtime_ns
+
+class Watcher:
+    """ iterate (path, stat) of settled files under path, forever
+    settle: seconds, poll: seconds between scans, 0: inotify if available """
+
+    def __init__(self, path, recursive=False, settle=SETTLE, poll=0):
+        self.path = path
+        self.recursive = recursive
+        self.settle = settle
+        self.poll = poll or POLL
+        # path: [(size, mtime_ns) at the last look or None, monotonic time of the last change]
+        self.pending = {}
+        # path: (size, mtime_ns) of given files
+        self.given = {}
+        self.inotify = None
+        if not poll:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as ex:
+                print(f'WATCH no inotify, scan every {self.poll:g}s: {ex}')
+
+    def __iter__(self):
+        if self.inotify:
+            # watches first, so files made during the scan are seen
+            self._watch_tree(self.path)
+        self._scan(self.path)
+        next_scan = time.monotonic() + self.poll
+        while True:
+            now = time.monotonic()
+            if not self.inotify and now >= next_scan:
+                self._scan(self.path)
+                next_scan = now + self.poll
+            yield from self._settled(now)
+            timeout = min((since + self.settle - now for _, since in self.pending.values()),
+                          default=None)
+            if not self.inotify:
+                timeout = min(next_scan - now, timeout if timeout is not None else self.poll)
+            timeout = None if timeout is None else max(timeout, 0)
+            if self.inotify:
+                self._events(self.inotify.read(timeout))
+            else:
+                time.sleep(timeout)
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+
+    def _watch_tree(self, path):
+        for dirpath, dirnames, _ in os.walk(path):
+            self.inotify.watch(dirpath)
+            if not self.recursive:
+                dirnames.clear()
+
+    def _scan(self, path):
+        """ pending: new and changed files under path """
+        now = time.monotonic()
+        for dirpath, dirnames, filenames in os.walk(path):
+            if not self.recursive:
+                dirnames.clear()
+            for name in filenames:
+                file = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(file)
+                except FileNotFoundError:
+                    continue
+                if not name.startswith('.') and self.given.get(file) != _key(stat):
+                    if self.pending.get(file, [None])[0] != _key(stat):
+                        self.pending[file] = [_key(stat), now]
+
+    def _events(self, events):
+        if events is None:
+            print('WATCH events lost, scanning')
+            self._scan(self.path)
+            return
+        now = time.monotonic()
+        for mask, path in events:
+            if mask & IN_ISDIR:
+                # moved in or made, files may be there before the watch
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(path)
+                    self._scan(path)
+            elif mask & GONE:
+                self.pending.pop(path, None)
+                self.given.pop(path, None)
+            elif not os.path.basename(path).startswith('.'):
+                self.pending[path] = [self.pending.get(path, [None])[0], now]
+
+    def _settled(self, now):
+        """ yield: (path, stat) of pending files unchanged for the settle time """
+        for path, (key, since) in list(self.pending.items()):
+            if now - since < self.settle:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if key is not None and key != _key(stat):
+                self.pending[path] = [_key(stat), now]
+                continue
+            del self.pending[path]
+            if self.given.get(path) != _key(stat):
+                self.given[path] = _key(stat)
+                yield path, stat
@@ -0,0 +1,255 @@
+""" work queue over a shared filesystem, jobs are claimed with lease files
+
+DIR/jobs/ID.json     queued job: source file, cpmyvideos.py arguments, cwd
+DIR/leases/ID.json   claim of a job, renewed (mtime) by the worker running it
+DIR/done/ID.json     job and result
+DIR/failed/ID.json
+
+Files appear atomically: written under a temporary name, then hard linked,
+which fails if the name exists (also on NFS). A lease not renewed for the
+lease time belongs to a dead worker; it is renamed away (one worker wins)
+and the job claimed again. Lease age is measured against the mtime of
+DIR/clock, touched by each worker, so node clocks need not agree.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import sys
+import time
+import uuid
+from contextlib import suppress
+import joblog
+import runner
+
+# seconds without renewal after which a lease is expired
+LEASE_TIME = 60.0
+# seconds between scans while the remaining jobs are leased by others
+POLL = 5.0
+STATES = ('jobs', 'leases', 'done', 'failed')
+HOST = socket.gethostname()
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cpmyvideos.py')
+
+def job_id(path):
+    return hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+
+class Queue:
+    """ queue directory, lease_time: seconds """
+
+    def __init__(self, path, lease_time=LEASE_TIME):
+        self.path = path
+        self.lease_time = lease_time
+        for state in STATES:
+            os.makedirs(os.path.join(path, state), exist_ok=True)
+
+    def file(self, state, jid):
+        return os.path.join(self.path, state, f'{jid}.json')
+
+    def enqueue(self, src, argv):
+        """ argv: cpmyvideos.py arguments without -s
+        return: job id, None if queued or done before """
+        jid = job_id(src)
+        if os.path.exists(self.file('done', jid)):
+            return None
+        job = {'id': jid, 'src': os.path.abspath(src), 'argv': argv,
+               'cwd': os.getcwd(), 'queued': time.time()}
+        try:
+            _create(self.file('jobs', jid), job)
+        except FileExistsError:
+            return None
+        # queued again after a failure
+        with suppress(FileNotFoundError):
+            os.remove(self.file('failed', jid))
+        return jid
+
+    def pending(self):
+        return any(name.endswith('.json')
+                   for name in os.listdir(os.path.join(self.path, 'jobs')))
+
+    def claim(self):
+        """ return: job dict with 'lease' token, None if nothing to claim """
+        now = self._clock()
+        for name in sorted(os.listdir(os.path.join(self.path, 'jobs'))):
+            if not name.endswith('.json'):
+                continue
+            jid = name[:-5]
+            lease = self.file('leases', jid)
+            token = self._expired(lease, now)
+            if token is False or (token is not None and not self._break(lease, token)):
+                continue
+            token = uuid.uuid4().hex
+            try:
+                _create(lease, {'host': HOST, 'pid': os.getpid(), 'token': token,
+                                'claimed': time.time()})
+            except FileExistsError:
+                continue
+            try:
+                job = _load(self.file('jobs', jid))
+            except FileNotFoundError:
+                # finished by another worker meanwhile
+                os.remove(lease)
+                continue
+            job['lease'] = token
+            return job
+        return None
+
+    async def renew(self, job):
+        """ return: False if the lease was taken over """
+        lease = self.file('leases', job['id'])
+        for retry in (True, False):
+            try:
+                if _load(lease).get('token') == job['lease']:
+                    os.utime(lease)
+                    return True
+                return False
+            except (FileNotFoundError, ValueError):
+                # a reclaiming worker may be putting it back
+                if retry:
+                    await asyncio.sleep(1)
+        return False
+
+    def finish(self, job, rcode):
+        state = 'done' if rcode == 0 else 'failed'
+        job = dict(job, rcode=rcode, host=HOST, finished=time.time())
+        del job['lease']
+        _write(self.file(state, job['id']), job)
+        os.remove(self.file('jobs', job['id']))
+        self.release(job)
+
+    def release(self, job):
+        with suppress(FileNotFoundError):
+            os.remove(self.file('leases', job['id']))
+
+    def _clock(self):
+        """ current time of the shared filesystem """
+        clock = os.path.join(self.path, 'clock')
+        try:
+            os.utime(clock)
+        except FileNotFoundError:
+            with open(clock, 'a', encoding='utf-8'):
+                pass
+        return os.stat(clock).st_mtime
+
+    def _expired(self, lease, now):
+        """ return: None if no lease, False if valid, token if expired """
+        try:
+            mtime = os.stat(lease).st_mtime
+            data = _load(lease)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            data = {}
+        if now - mtime > self.lease_time:
+            return data.get('token', '')
+        if data.get('host') == HOST and not _alive(data.get('pid')):
+            return data.get('token', '')
+        return False
+
+    def _break(self, lease, token):
+        """ remove the expired lease with token, return: True if removed """
+        stale = f'{lease}.{HOST}.{os.getpid()}.stale'
+        try:
+            os.rename(lease, stale)
+        except FileNotFoundError:
+            return False
+        try:
+            renewed = _load(stale).get('token', '') != token
+        except ValueError:
+            renewed = False
+        if renewed:
+            # claimed again between the check and the rename, put it back
+            with suppress(FileExistsError):
+                os.link(stale, lease)
+        os.remove(stale)
+        return not renewed
+
+def work(queue, jobs=1):
+    """ claim and run jobs until the queue is empty, jobs: at once
+    return: number of failed jobs """
+    return runner.run_sync(_work(queue, jobs))
+
+async def _work(queue, jobs):
+    failed = 0
+
+    async def slot():
+        nonlocal failed
+        while True:
+            job = queue.claim()
+            if job is None:
+                if not queue.pending():
+                    return
+                await asyncio.sleep(POLL)
+                continue
+            if await _run(queue, job) not in (0, None):
+                failed += 1
+
+    await asyncio.gather(*(slot() for _ in range(jobs)))
+    return failed
+
+async def _run(queue, job):
+    """ run one job, renew its lease meanwhile
+    return: exit code, None if the lease was lost """
+    print(f"CLAIM {job['id']} {job['src']}", flush=True)
+    cmd = [sys.executable, SCRIPT, *job['argv'], '-s', job['src']]
+    out = joblog.JobLog(buffered=True)
+    # relative paths in the arguments work where the job was queued
+    cwd = job['cwd'] if os.path.isdir(job['cwd']) else None
+    task = asyncio.create_task(runner.run(cmd, out=out, cwd=cwd))
+    try:
+        while True:
+            done, _ = await asyncio.wait([task], timeout=queue.lease_time / 4)
+            if done:
+                break
+            if not await queue.renew(job):
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+                print(out.getvalue(), end='')
+                print(f"LEASE LOST {job['id']} {job['src']}", flush=True)
+                return None
+        rcode = task.result()
+    except BaseException:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+        queue.release(job)
+        raise
+    print(out.getvalue(), end='')
+    print(f"{'DONE' if rcode == 0 else 'FAILED'} {job['id']} {job['src']} code: {rcode}",
+          flush=True)
+    queue.finish(job, rcode)
+    return rcode
+
+def _alive(pid):
+    if not isinstance(pid, int):
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _load(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+def _temp(path, data):
+    temp = f'{path}.{HOST}.{os.getpid()}.tmp'
+    with open(temp, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+    return temp
+
+def _create(path, data):
+    """ write atomically, FileExistsError if path exists """
+    temp = _temp(path, data)
+    try:
+        os.link(temp, path)
+    finally:
+        os.remove(temp)
+
+def _write(path, data):
+    os.replace(_temp(path, data), path)
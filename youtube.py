@@ -7,17 +7,25 @@ https://support.google.com/youtube/answer/1722171
 
 import sys
 import os.path
+import hashlib
 import json
 import argparse
+import importlib
 #from pprint import pprint, pformat
 from mymediainfo import MyMediaInfo
-from lib import run_cmd, ENCODERS
-import enc_hevc_vaapi
+from lib import run_cmd, cache_path
+
+# first pass logs kept, oldest removed above this, bytes
+PASS_CACHE_SIZE = 4 * 2**30
+# output params not changing the first pass analysis
+PASS_RATE_PARAMS = ('b:v', 'maxrate:v', 'bufsize', 'c:a', 'ac', 'b:a', 'ar', 'movflags',
+                    'use_editlist')
 
 class YouTube:
 
     DEFAULT_YT_CATEGORY = 'HDR'
     DEFAULT_CRF = '18'
+    ENCODERS = ('sw', 'amf', 'vaapi', 'nv')
 
     def __init__(self):
         parser = argparse.ArgumentParser()
@@ -29,20 +37,26 @@ class YouTube:
                           default=self.DEFAULT_YT_CATEGORY,
                           help='YouTube category (default: %(default)s)')
         parser.add_argument('--crf', default=self.DEFAULT_CRF, help='CRF')
-        parser.add_argument('--enc', default='sw',
+        parser.add_argument('--enc', default='sw', choices=self.ENCODERS,
                             help='Encoder (%(default)s)')
         parser.add_argument('--opencl', action='store_true')
         parser.add_argument('--deint', action='store_true',
                             help='deinterlace')
         parser.add_argument('--preset', default='slow',
                             help='preset (%(default)s)')
+        parser.add_argument('--2pass', dest='two_pass', action='store_true',
+                            help='Two pass bitrate encode (sw), first pass logs are '
+                                 'cached and reused at other bitrates')
         parser.add_argument('-t', dest='duration')
         parser.add_argument('--dry', action='store_true',
                             help='Dry run')
         self.args = parser.parse_args()
 
-        if not self.args.enc in ENCODERS:
-            sys.exit(f"Bad encoder '{self.args.enc}', use one of {ENCODERS}")
+        if self.args.two_pass:
+            if self.args.enc != 'sw':
+                sys.exit('--2pass needs --enc sw')
+            # bitrate from the category
+            self.args.crf = None
 
         script_dir = os.path.dirname(os.path.abspath(__file__))
         conf_path = os.path.join(script_dir, 'youtube.json')
@@ -107,7 +121,7 @@ class YouTube:
                     params['qp_b'] = self.args.crf
             case 'vaapi':
                 # ffmpeg -hide_banner -h encoder=h264_vaapi|less
-                params_in = enc_hevc_vaapi.PARAMS_IN
+                params_in = importlib.import_module('enc_hevc_vaapi').PARAMS_IN
                 params = {
                     'c:v': 'h264_vaapi',
                     'compression_level': '29',
@@ -207,10 +221,64 @@ class YouTube:
             vf = [f"{key}={value}" for key, value in filter_v.items()]
             cmd.extend(['-filter:v', ','.join(vf)])
 
+        if self.args.two_pass:
+            self.run_2pass(cmd, params_in, params, filter_v)
+            return
         cmd.append('-y')
         cmd.append(self.args.out_file)
 
-        run_cmd(cmd, self.args.dry)
+        run_cmd(cmd, dry=self.args.dry)
+
+    def run_2pass(self, cmd, params_in, params, filter_v):
+        """ cmd: without output file, the first pass log is taken from the
+        cache when the source and the analysis params match """
+        analysis = {key: value for key, value in params.items() if key not in PASS_RATE_PARAMS}
+        key = hashlib.blake2b(json.dumps(
+            [importlib.import_module('dedup').fingerprint(self.args.in_file), params_in,
+             analysis, filter_v],
+            sort_keys=True).encode(), digest_size=16).hexdigest()
+        cache_dir = cache_path('x264pass')
+        os.makedirs(cache_dir, exist_ok=True)
+        log = os.path.join(cache_dir, key)
+        if os.path.exists(f'{log}-0.log'):
+            print(f'2PASS first pass cached {log}')
+            # keep recently used
+            os.utime(f'{log}-0.log')
+        else:
+            temp = f'{log}.{os.getpid()}'
+            rcode = run_cmd(cmd + ['-pass', '1', '-passlogfile', temp, '-an', '-f', 'null', '-'],
+                            dry=self.args.dry)
+            if rcode != 0:
+                for name in os.listdir(cache_dir):
+                    if name.startswith(os.path.basename(temp)):
+                        os.remove(os.path.join(cache_dir, name))
+                sys.exit(rcode)
+            if not self.args.dry:
+                if os.path.exists(f'{temp}-0.log.mbtree'):
+                    os.replace(f'{temp}-0.log.mbtree', f'{log}-0.log.mbtree')
+                # the log last, it marks a complete entry
+                os.replace(f'{temp}-0.log', f'{log}-0.log')
+                prune_pass_cache(cache_dir)
+        run_cmd(cmd + ['-pass', '2', '-passlogfile', log, '-y', self.args.out_file],
+                dry=self.args.dry)
+
+def prune_pass_cache(cache_dir):
+    """ remove the least recently used first pass logs above PASS_CACHE_SIZE """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('-0.log'):
+            path = os.path.join(cache_dir, name)
+            files = [path, f'{path}.mbtree']
+            size = sum(os.path.getsize(file) for file in files if os.path.exists(file))
+            entries.append((os.path.getmtime(path), size, files))
+    total = sum(size for _, size, _ in entries)
+    for _, size, files in sorted(entries):
+        if total <= PASS_CACHE_SIZE:
+            break
+        for file in files:
+            if os.path.exists(file):
+                os.remove(file)
+        total -= size
 
 
 def __main__():